@@ -3,15 +3,21 @@ from datetime import datetime
 import numpy as np
 import matplotlib.pyplot as plt
 
-from common import dt, clampL, clampH, clamp, lerp, PID, PID2, plt_show_maxed, color_grad, fit_plot, Filter
+from common import dt, clampL, clampH, clamp, lerp, PID, PID2, plt_show_maxed, color_grad, fit_plot, Filter, noise_streams
 from Engine import Engine
+from Metrics import Metrics
+from PIDSearch import optimize_PID
+from Recorder import Recorder
 
 
 class ATC(object):
     twoPi = np.pi * 2
     tenth_deg = 0.1 / 180 * np.pi
+    decimate = 1
+    # stop simulations once the error has settled or diverged, see Metrics
+    early_exit = False
 
-    def __init__(self, engine, lever, MoI, atPID, base_level, on_update=None, wheels_torque=0):
+    def __init__(self, engine, lever, MoI, atPID, base_level, on_update=None, wheels_torque=0, rng=None):
         self.error = 0
         self.atPID = atPID
         self.base_level = base_level
@@ -32,6 +38,11 @@ class ATC(object):
         self.on_update = on_update
         self.AV = 0
         self.AA = 0
+        self.seed(rng)
+
+    def seed(self, seed=None):
+        """Restarts the random stream of the angular velocity noise"""
+        self.noise, = noise_streams(seed)
 
     def reset(self):
         self.AV = 0
@@ -51,7 +62,7 @@ class ATC(object):
         self.engineF.update()
         self.engineR.update()
         self.AA = (self.engineF.torque - self.engineR.torque + self.wheels*self.atPID.action) / self.MoI
-        self.AV += self.AA * dt + (np.random.rand()-0.5)*1e-3
+        self.AV += self.AA * dt + (self.noise.next()-0.5)*1e-3
 
     def update(self):
         if self.on_update is not None:
@@ -76,52 +87,60 @@ class ATC(object):
             return ('Zero at: %f s\n'
                     '%s: %f %s' % (self.time, self.desc, self.speed, self.units))
 
+    def _record_attitude(self, rec, t, prev_error, zero_stats):
+        if not zero_stats and (self.error < self.tenth_deg or self.error*prev_error < 0):
+            zero_stats = self.ZeroStats(t, abs(self.AV+self.AA*dt), 'AV', 'rad/s')
+        rec.record(t, self.error, self.atPID.action,
+                   (self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust)
+        self.metrics.update(t, self.error, self.atPID.action)
+        return zero_stats
+
+    def _stop(self, zero_stats, end_on_zero):
+        # a settled run goes on until the zero is registered
+        return (end_on_zero and zero_stats or
+                self.early_exit and (self.metrics.diverged or self.metrics.settled and zero_stats))
+
     def simulate_static_attitude(self, start_error, end_time, end_on_zero=False):
         self.error = start_error / 180.0 * np.pi
         t = 0
-        time = [0]
-        error = [self.error]
-        action = [self.atPID.action]
-        thrust = [self.engineF.limit]
+        rec = Recorder(('time', 'error', 'action', 'thrust'), end_time, decimate=self.decimate)
+        rec.record(0, self.error, self.atPID.action, self.engineF.limit)
         zero_stats = None
+        self.metrics = Metrics(self.error, min_band=self.tenth_deg)
         self.reset()
         while t < end_time:
             t += dt
+            prev_error = self.error
             self.update()
             # print 'Time: %f' % t
             # print 'AT PID: ' + str(self.atPID)
             # print 'AV PID: ' + str(self.avPID) + '\n'
-            if not zero_stats and (self.error < self.tenth_deg or self.error*error[-1] < 0):
-                zero_stats = self.ZeroStats(t, abs(self.AV+self.AA*dt), 'AV', 'rad/s')
-            error.append(self.error)
-            action.append(self.atPID.action)
-            thrust.append((self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust)
-            time.append(t)
-        return 'dAng [AA %.2f]' % self.MaxAA, time, np.fromiter(error, float)/np.pi*180, action, thrust, zero_stats
+            zero_stats = self._record_attitude(rec, t, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return 'dAng [AA %.2f]' % self.MaxAA, rec['time'], rec['error']/np.pi*180, rec['action'], rec['thrust'], zero_stats
 
     def simulate_linear_attitude(self, start_error, error_change_rate, end_time, end_on_zero=False):
         self.error = start_error / 180.0 * np.pi
         error_change_rate *= np.pi/180.0
         t = 0
-        time = [0]
-        error = [self.error]
-        action = [self.atPID.action]
-        thrust = [self.engineF.limit]
+        rec = Recorder(('time', 'error', 'action', 'thrust'), end_time, decimate=self.decimate)
+        rec.record(0, self.error, self.atPID.action, self.engineF.limit)
         zero_stats = None
+        self.metrics = Metrics(self.error, min_band=self.tenth_deg)
         self.reset()
         while t < end_time:
             t += dt
+            prev_error = self.error
             self.error += error_change_rate * dt
             self.update()
-            if not zero_stats and (self.error < self.tenth_deg or self.error*error[-1] < 0):
-                zero_stats = self.ZeroStats(t, abs(self.AV+self.AA*dt), 'AV', 'rad/s')
-            error.append(self.error)
-            action.append(self.atPID.action)
-            thrust.append((self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust)
-            time.append(t)
-        return 'dAng [AA %.2f]' % self.MaxAA, time, np.fromiter(error, float)/np.pi*180, action, thrust, zero_stats
-
-    def optimize_at_PID(self, start_error, av_threshold, step, end_time, P, I, D):
+            zero_stats = self._record_attitude(rec, t, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return 'dAng [AA %.2f]' % self.MaxAA, rec['time'], rec['error']/np.pi*180, rec['action'], rec['thrust'], zero_stats
+
+    def optimize_at_PID(self, start_error, av_threshold, step, end_time, P, I, D, strategy=None):
+        if strategy is not None:
+            return optimize_PID(self.atPID, 'atPID', lambda: self.simulate_static_attitude(start_error, end_time, True)[-1],
+                                av_threshold, (P, I, D), strategy)
         best_pid = None
         best_stats = None
         for p in np.linspace(P[0], P[1], step):
@@ -1,16 +1,30 @@
 import os
+import sys
 import csv
+import hashlib
+import pickle
 from datetime import datetime
+from multiprocessing import Pool, cpu_count
 import numpy as np
 import matplotlib.pyplot as plt
 
 from common import dt, clampL, clampH, clamp, PID, PID2, plt_show_maxed, color_grad, Filter, fit_plot, SimpleKalman, \
-    PID3
-from Engine import Engine
+    PID3, pid_bank, noise_streams
+from Engine import Engine, EngineArray
+from EngineCatalog import EngineCatalog
+from Metrics import Metrics
+from PIDSearch import optimize_PID
+from Recorder import Recorder
+from regression import regression, load_baseline
+from scenarios import arg_parser, specs_from_args, expand, run_scenarios, write_results
+from ResultStore import ResultStore
 
 class ATC(object):
     twoPi = np.pi * 2
     tenth_deg = 0.1/180*np.pi
+    decimate = 1
+    # stop simulations once the error has settled or diverged, see Metrics
+    early_exit = False
 
     class ZeroStats(object):
         def __init__(self, time, speed, desc, units):
@@ -24,7 +38,11 @@ class ATC(object):
             return ('Zero at: %f s\n'
                     '%s: %f %s' % (self.time, self.desc, self.speed, self.units))
 
-    def __init__(self, engine, lever, MoI, atPID, avPID, base_level, on_update=None, wheels_torque=0):
+        def __reduce__(self):
+            # a nested class is not picklable by reference in python2
+            return _zero_stats, (self.time, self.speed, self.desc, self.units)
+
+    def __init__(self, engine, lever, MoI, atPID, avPID, base_level, on_update=None, wheels_torque=0, rng=None):
         self.error = 0
         self.atPID = atPID
         self.avPID = avPID
@@ -47,6 +65,11 @@ class ATC(object):
         self.time = 0
         self.AV = 0
         self.AA = 0
+        self.seed(rng)
+
+    def seed(self, seed=None):
+        """Restarts the random streams of the angular velocity noise and of the error disturbances"""
+        self.noise, self.disturbance = noise_streams(seed, 2)
 
     @property
     def errorF(self):
@@ -61,10 +84,10 @@ class ATC(object):
         self.engineR.thrust = self.engineF.maxThrust * self.base_level
 
     def _error1(self, alpha):
-        return 1-alpha + np.random.rand()*alpha*2
+        return 1-alpha + self.disturbance.next()*alpha*2
 
     def _error2(self, alpha):
-        return (0.5-np.random.rand())*alpha*2
+        return (0.5-self.disturbance.next())*alpha*2
 
     def updateAV(self):
         action = self.avPID.action
@@ -77,7 +100,7 @@ class ATC(object):
         self.engineF.update()
         self.engineR.update()
         self.AA = ((self.engineF.torque - self.engineR.torque) + self.wheels*self.avPID.action) / self.MoI
-        self.AV += self.AA * dt + (np.random.rand()-0.5)*1e-3
+        self.AV += self.AA * dt + (self.noise.next()-0.5)*1e-3
 
     def update(self):
         if self.on_update is not None:
@@ -93,11 +116,11 @@ class ATC(object):
 
     def simulate_constant_angular_velocity(self, needed_av, end_time, end_on_zero=False):
         self.time = 0
-        time = [0]
-        error = [needed_av]
-        action = [self.avPID.action]
-        thrust = [(self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust]
+        rec = Recorder(('time', 'error', 'action', 'thrust'), end_time, decimate=self.decimate)
+        rec.record(0, needed_av, self.avPID.action, (self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust)
+        prev_error = needed_av
         zero_stats = None
+        self.metrics = Metrics(needed_av, min_band=self.tenth_deg)
         self.reset()
         while self.time < end_time:
             self.time += dt
@@ -107,89 +130,109 @@ class ATC(object):
             else:
                 self.avPID.update(av_error)
             self.updateAV()
-            if not zero_stats and (av_error < self.tenth_deg or av_error*error[-1] < 0):
+            if not zero_stats and (av_error < self.tenth_deg or av_error*prev_error < 0):
                 zero_stats = self.ZeroStats(self.time, abs(self.AA), 'AA', 'rad/s2')
-            error.append(av_error)
-            action.append(self.avPID.action)
-            thrust.append((self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust)
-            time.append(self.time)
-            if zero_stats and end_on_zero: break
-        return 'dAV [AA %.2f]' % self.MaxAA, time, np.fromiter(error, float)/np.pi*180, action, thrust, zero_stats
+            prev_error = av_error
+            rec.record(self.time, av_error, self.avPID.action,
+                       (self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust)
+            self.metrics.update(self.time, av_error, self.avPID.action)
+            if self._stop(zero_stats, end_on_zero): break
+        return 'dAV [AA %.2f]' % self.MaxAA, rec['time'], rec['error']/np.pi*180, rec['action'], rec['thrust'], zero_stats
+
+    def _record_attitude(self, rec, prev_error, zero_stats):
+        if not zero_stats and (self.error < self.tenth_deg or self.error*prev_error < 0):
+            zero_stats = self.ZeroStats(self.time, abs(self.AV+self.AA*dt), 'AV', 'rad/s')
+        rec.record(self.time, self.error, self.avPID.action,
+                   (self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust)
+        self.metrics.update(self.time, self.error, self.avPID.action)
+        return zero_stats
+
+    def _stop(self, zero_stats, end_on_zero):
+        # a settled run goes on until the zero is registered
+        return (end_on_zero and zero_stats or
+                self.early_exit and (self.metrics.diverged or self.metrics.settled and zero_stats))
+
+    def _attitude_results(self, rec, zero_stats):
+        return 'dAng [AA %.2f]' % self.MaxAA, rec['time'], rec['error']/np.pi*180, rec['action'], rec['thrust'], zero_stats
 
     def simulate_static_attitude(self, start_error, end_time, end_on_zero=False):
         self.error = start_error / 180.0 * np.pi
         self.time = 0
-        time = [0]
-        error = [self.error]
-        action = [self.avPID.action]
-        thrust = [self.engineF.limit]
+        rec = Recorder(('time', 'error', 'action', 'thrust'), end_time, decimate=self.decimate)
+        rec.record(0, self.error, self.avPID.action, self.engineF.limit)
         zero_stats = None
+        self.metrics = Metrics(self.error, min_band=self.tenth_deg)
         self.reset()
         while self.time < end_time:
             self.time += dt
+            prev_error = self.error
             self.update()
-            if not zero_stats and (self.error < self.tenth_deg or self.error*error[-1] < 0):
-                zero_stats = self.ZeroStats(self.time, abs(self.AV+self.AA*dt), 'AV', 'rad/s')
-            error.append(self.error)
-            action.append(self.avPID.action)
-            thrust.append((self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust)
-            time.append(self.time)
-        return 'dAng [AA %.2f]' % self.MaxAA, time, np.fromiter(error, float)/np.pi*180, action, thrust, zero_stats
+            zero_stats = self._record_attitude(rec, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return self._attitude_results(rec, zero_stats)
 
     def simulate_linear_attitude(self, start_error, error_change_rate, end_time, end_on_zero=False):
         self.error = start_error / 180.0 * np.pi
         error_change_rate *= np.pi/180.0
         self.time = 0
-        time = [0]
-        error = [self.error]
-        action = [self.atPID.action]
-        thrust = [self.engineF.limit]
+        rec = Recorder(('time', 'error', 'action', 'thrust'), end_time, decimate=self.decimate)
+        rec.record(0, self.error, self.atPID.action, self.engineF.limit)
         zero_stats = None
+        self.metrics = Metrics(self.error, min_band=self.tenth_deg)
         self.reset()
         while self.time < end_time:
             self.time += dt
+            prev_error = self.error
             self.error += error_change_rate * dt
             self.update()
-            if not zero_stats and (self.error < self.tenth_deg or self.error*error[-1] < 0):
-                zero_stats = self.ZeroStats(self.time, abs(self.AV+self.AA*dt), 'AV', 'rad/s')
-            error.append(self.error)
-            action.append(self.avPID.action)
-            thrust.append((self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust)
-            time.append(self.time)
-        return 'dAng [AA %.2f]' % self.MaxAA, time, np.fromiter(error, float)/np.pi*180, action, thrust, zero_stats
+            zero_stats = self._record_attitude(rec, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return self._attitude_results(rec, zero_stats)
 
     def simulate_random_attitude(self, start_error, error_change_rate, error_change_time, end_time, end_on_zero=False):
         self.error = start_error / 180.0 * np.pi
         error_change_rate *= np.pi/180.0
         time_to_change = error_change_time
         self.time = 0
-        time = [0]
-        error = [self.error]
-        action = [self.atPID.action]
-        thrust = [self.engineF.limit]
+        rec = Recorder(('time', 'error', 'action', 'thrust'), end_time, decimate=self.decimate)
+        rec.record(0, self.error, self.atPID.action, self.engineF.limit)
         zero_stats = None
+        self.metrics = Metrics(self.error, min_band=self.tenth_deg)
         self.reset()
         while self.time < end_time:
             self.time += dt
-            time_to_change -= dt*np.random.rand()
+            prev_error = self.error
+            time_to_change -= dt*self.disturbance.next()
             if time_to_change < 0:
-                self.error += error_change_rate * (np.random.rand()-0.5) * 2
+                self.error += error_change_rate * (self.disturbance.next()-0.5) * 2
                 time_to_change = error_change_time
             self.update()
-            if not zero_stats and (self.error < self.tenth_deg or self.error*error[-1] < 0):
-                zero_stats = self.ZeroStats(self.time, abs(self.AV+self.AA*dt), 'AV', 'rad/s')
-            error.append(self.error)
-            action.append(self.avPID.action)
-            thrust.append((self.engineF.thrust-self.engineR.thrust) / self.engineF.maxThrust)
-            time.append(self.time)
-        return 'dAng [AA %.2f]' % self.MaxAA, time, np.fromiter(error, float)/np.pi*180, action, thrust, zero_stats
-
-    def optimize_av_PID(self, needed_av, aa_threshold, step, end_time, P, I, D):
+            zero_stats = self._record_attitude(rec, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return self._attitude_results(rec, zero_stats)
+
+    def optimize_av_PID(self, needed_av, aa_threshold, step, end_time, P, I, D, workers=None, seed=0, strategy=None,
+                        store=None):
+        """
+        Grid search of avPID gains.
+        With workers=None the grid is swept serially by this instance;
+        otherwise it is swept by sweep_PID in a pool of that many processes,
+        reusing the points found in the store, if any.
+        A PIDSearch strategy replaces the grid (step and workers are then ignored).
+        """
+        if self.instant: D = (0,0)
+        if strategy is not None:
+            return optimize_PID(self.avPID, 'avPID',
+                                lambda: self.simulate_constant_angular_velocity(needed_av, end_time, True)[-1],
+                                aa_threshold, (P, I, D), strategy)
+        if workers is not None:
+            table = self.sweep_PID('avPID', 'simulate_constant_angular_velocity', (needed_av, end_time, True),
+                                   step, P, I, D, workers, seed, store=store)
+            return self._apply_best(table, 'avPID', aa_threshold)
         best_pid = None
         best_stats = None
         for p in np.linspace(P[0], P[1], step):
             for i in np.linspace(I[0], I[1], step):
-                if self.instant: D = (0,0)
                 for d in np.linspace(D[0], D[1], step):
                     self.avPID.setPID(p,i,d)
                     name, time, error, limit, thrust, zero_stats = self.simulate_constant_angular_velocity(needed_av,
@@ -221,7 +264,22 @@ class ATC(object):
             return best_pid
         return None
 
-    def optimize_at_PID(self, start_error, av_threshold, step, end_time, P, I, D):
+    def optimize_at_PID(self, start_error, av_threshold, step, end_time, P, I, D, workers=None, seed=0, strategy=None,
+                        store=None):
+        """
+        Grid search of atPID gains.
+        With workers=None the grid is swept serially by this instance;
+        otherwise it is swept by sweep_PID in a pool of that many processes,
+        reusing the points found in the store, if any.
+        A PIDSearch strategy replaces the grid (step and workers are then ignored).
+        """
+        if strategy is not None:
+            return optimize_PID(self.atPID, 'atPID', lambda: self.simulate_static_attitude(start_error, end_time, True)[-1],
+                                av_threshold, (P, I, D), strategy)
+        if workers is not None:
+            table = self.sweep_PID('atPID', 'simulate_static_attitude', (start_error, end_time, True),
+                                   step, P, I, D, workers, seed, store=store)
+            return self._apply_best(table, 'atPID', av_threshold)
         best_pid = None
         best_stats = None
         for p in np.linspace(P[0], P[1], step):
@@ -240,6 +298,94 @@ class ATC(object):
             return best_pid
         return None
 
+    def scenario(self):
+        """
+        Compact picklable description of this controller in its initial state;
+        ATC.from_scenario() builds a new instance from it.
+        """
+        engine = Engine(self.engineF.maxThrust / 2, self.engineF.acceleration, self.engineF.deceleration)
+        return pickle.dumps((engine, self.engineF.lever, self.MoI, self.atPID, self.avPID,
+                             self.base_level, self.on_update, self.wheels), 2)
+
+    @classmethod
+    def from_scenario(cls, scenario):
+        atc = cls(*pickle.loads(scenario))
+        atc.atPID.reset()
+        atc.avPID.reset()
+        return atc
+
+    @staticmethod
+    def _grid(lo, hi, step):
+        return np.linspace(lo, hi, step) if lo != hi else np.array([float(lo)])
+
+    def sweep_PID(self, pid, method, args, step, P, I, D, workers=None, seed=0, early_exit=False, store=None):
+        """
+        Runs one simulation per (p, i, d) point of the grid in a pool of processes.
+        Every point is simulated by a fresh copy of this controller built from
+        its scenario(), with the random streams seeded by the seed and the point
+        itself, so the results do not depend on the number of workers or on the grid.
+        :param pid: 'avPID' or 'atPID'
+        :param method: name of the simulate_* method and its args
+        :param workers: number of processes; None means cpu_count(), 1 runs in this process
+        :param early_exit: stop each simulation once it has settled or diverged
+        :param store: a ResultStore; the points stored with the same scenario are
+                      not simulated again and the new ones are stored in it
+        :return: pandas DataFrame with p, i, d, the ZeroStats (NaN if there was no zero)
+                 and the Metrics of each point
+        """
+        import pandas as pd
+        points = [(p, i, d) for p in self._grid(P[0], P[1], step)
+                  for i in self._grid(I[0], I[1], step)
+                  for d in self._grid(D[0], D[1], step)]
+        scenario = self.scenario()
+        rows = [None] * len(points)
+        keys = [None] * len(points)
+        if store is not None:
+            fingerprint = hashlib.sha1(scenario).hexdigest()
+            for n, point in enumerate(points):
+                keys[n] = store.key('sweep_PID', fingerprint, pid, method, args, point, seed, early_exit)
+                rows[n] = store.get(keys[n])
+        todo = [point for point, row in zip(points, rows) if row is None]
+        if todo:
+            workers = min(workers or cpu_count(), len(todo))
+            size = -(-len(todo) // workers)
+            work = [(scenario, pid, method, args, todo[c:c+size], seed, early_exit)
+                    for c in range(0, len(todo), size)]
+            if workers > 1:
+                pool = Pool(workers)
+                try:
+                    chunks = pool.map(_sweep_points, work, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                chunks = [_sweep_points(w) for w in work]
+            simulated = iter([r for chunk in chunks for r in chunk])
+            for n, row in enumerate(rows):
+                if row is not None: continue
+                rows[n] = next(simulated)
+                if store is not None:
+                    p, i, d = points[n]
+                    store.put(keys[n], rows[n], 'sweep_PID', False, pid=pid, method=method, args=args,
+                              p=p, i=i, d=d, seed=seed)
+            if store is not None:
+                store.commit()
+        return pd.DataFrame(rows, columns=('p', 'i', 'd', 'zero_time', 'zero_speed', 'metric') + Metrics.columns)
+
+    def _apply_best(self, table, pid, threshold):
+        best = None
+        for row in table.itertuples():
+            if np.isnan(row.metric): continue
+            if best is None or row.zero_speed < threshold and row.metric < best.metric:
+                best = row
+        if best is not None and best.zero_speed < threshold:
+            best_pid = (best.p, best.i, best.d)
+            getattr(self, pid).setPID(*best_pid)
+            desc, units = ('AA', 'rad/s2') if pid == 'avPID' else ('AV', 'rad/s')
+            print '%s: %s\n%s\n' % (pid, best_pid, self.ZeroStats(best.zero_time, best.zero_speed, desc, units))
+            return best_pid
+        return None
+
     @classmethod
     def analyze_results(cls, cols, col, *results):
         colors = color_grad(len(results))
@@ -261,6 +407,188 @@ class ATC(object):
             plt.ylabel('thrust')
 
 
+class ATCEnsemble(object):
+    """
+    Lanes of cascaded attitude controllers advanced together.
+
+    Lane k is the k-th ATC passed to the constructor, that is, its lever, MoI,
+    base level, wheels, engine response and PID controllers; the atPID->avPID
+    cascade, the engines and the dynamics are computed as arrays over lanes.
+    on_update callbacks are scalar code and are not supported.
+    Each lane draws its noise and disturbances from the random streams of its ATC,
+    so lane k reproduces the scalar simulation of the k-th ATC exactly.
+    """
+    twoPi = ATC.twoPi
+    tenth_deg = ATC.tenth_deg
+
+    def __init__(self, atcs):
+        if any(atc.on_update is not None for atc in atcs):
+            raise ValueError('ATCEnsemble does not support on_update')
+
+        def lanes(attr):
+            return np.array([attr(atc) for atc in atcs], float)
+        self.size = len(atcs)
+        self.maxThrust = lanes(lambda atc: atc.engineF.maxThrust)
+        self.base_level = lanes(lambda atc: atc.base_level)
+        self.MoI = lanes(lambda atc: atc.MoI)
+        self.wheels = lanes(lambda atc: atc.wheels)
+        self.MaxAA = lanes(lambda atc: atc.MaxAA)
+        self.atPID = pid_bank([atc.atPID for atc in atcs])
+        self.avPID = pid_bank([atc.avPID for atc in atcs])
+        self.noise = [atc.noise for atc in atcs]
+        self.disturbance = [atc.disturbance for atc in atcs]
+        # engineF and engineR of the lanes
+        self.engines = EngineArray.from_engines([[atc.engineF for atc in atcs], [atc.engineR for atc in atcs]])
+        self.error = np.zeros(self.size)
+        self.time = 0
+        self.reset()
+
+    def reset(self):
+        self.AV = np.zeros(self.size)
+        self.AA = np.zeros(self.size)
+        self.engines.limit = np.vstack([self.base_level] * 2)
+        self.engines.thrust = self.engines.maxThrust * self.engines.limit
+
+    @property
+    def thrust(self): return self.engines.thrust
+
+    @property
+    def thrustF(self): return self.engines.thrust[0]
+
+    @property
+    def thrustR(self): return self.engines.thrust[1]
+
+    def updateAV(self, noise):
+        action = self.avPID.action
+        pos = action > 0
+        self.engines.limit = np.vstack((
+            np.where(pos, np.minimum(self.base_level + action, 1), np.maximum(self.base_level + action, 0)),
+            np.where(pos, np.maximum(self.base_level - action, 0), np.minimum(self.base_level - action, 1))))
+        self.engines.update()
+        torque = self.engines.torque
+        self.AA = ((torque[0] - torque[1]) + self.wheels * action) / self.MoI
+        self.AV = self.AV + (self.AA * dt + (noise - 0.5) * 1e-3)
+
+    def update(self, noise):
+        self.atPID.update(np.abs(self.error))
+        self.avPID.update(self.atPID.action * np.sign(self.error) - self.AV)
+        self.updateAV(noise)
+        error = np.mod(self.error - self.AV * dt, self.twoPi)
+        self.error = np.where(error > np.pi, error - self.twoPi, np.where(error < -np.pi, error + self.twoPi, error))
+
+    def _lanes(self, value):
+        return np.array(np.broadcast_to(np.asarray(value, float), (self.size,)))
+
+    @staticmethod
+    def _steps(end_time):
+        # the number of steps of the scalar "while time < end_time: time += dt" loop
+        time = 0
+        steps = 0
+        while time < end_time:
+            time += dt
+            steps += 1
+        return steps
+
+    def _end_steps(self, end_time):
+        end_time = self._lanes(end_time)
+        steps = dict((e, self._steps(e)) for e in set(end_time))
+        return np.array([steps[e] for e in end_time])
+
+    def _lane_draws(self, steps, draw):
+        # draws steps[k] samples for lane k, padded to the longest lane
+        draws = np.zeros((steps.max(), self.size))
+        for k in range(self.size):
+            draws[:steps[k], k] = draw(k, steps[k])
+        return draws
+
+    def _simulate(self, start_error, error_change, steps, initial_action):
+        self.error = self._lanes(start_error) / 180.0 * np.pi
+        total = steps.max()
+        noise = self._lane_draws(steps, lambda k, n: self.noise[k].take(n))
+        time = np.empty(total + 1)
+        error = np.empty((total + 1, self.size))
+        action = np.empty((total + 1, self.size))
+        thrust = np.empty((total + 1, self.size))
+        time[0] = 0
+        error[0] = self.error
+        action[0] = initial_action.action
+        thrust[0] = self.engines.limit[0]
+        zero_time = np.full(self.size, np.nan)
+        zero_speed = np.full(self.size, np.nan)
+        self.time = 0
+        self.reset()
+        for step in range(1, total + 1):
+            self.time += dt
+            prev_error = self.error
+            if error_change is not None:
+                self.error = self.error + (error_change if error_change.ndim == 1 else error_change[step - 1])
+            self.update(noise[step - 1])
+            zero = ((self.error < self.tenth_deg) | (self.error * prev_error < 0)) & np.isnan(zero_time) & (steps >= step)
+            zero_time[zero] = self.time
+            zero_speed[zero] = np.abs(self.AV + self.AA * dt)[zero]
+            time[step] = self.time
+            error[step] = self.error
+            action[step] = self.avPID.action
+            thrust[step] = (self.thrust[0] - self.thrust[1]) / self.maxThrust
+        error = error / np.pi * 180
+        return [('dAng [AA %.2f]' % self.MaxAA[k], time[:steps[k] + 1],
+                 error[:steps[k] + 1, k], action[:steps[k] + 1, k], thrust[:steps[k] + 1, k],
+                 None if np.isnan(zero_time[k]) else ATC.ZeroStats(zero_time[k], zero_speed[k], 'AV', 'rad/s'))
+                for k in range(self.size)]
+
+    def simulate_static_attitude(self, start_error, end_time):
+        """
+        :param start_error, end_time: scalars or arrays over lanes
+        :return: list of the ATC.simulate_static_attitude results of the lanes
+        """
+        return self._simulate(start_error, None, self._end_steps(end_time), self.avPID)
+
+    def simulate_linear_attitude(self, start_error, error_change_rate, end_time):
+        """As simulate_static_attitude, but the error also changes at error_change_rate (per lane)"""
+        error_change = self._lanes(error_change_rate) * (np.pi / 180.0) * dt
+        return self._simulate(start_error, error_change, self._end_steps(end_time), self.atPID)
+
+    def _random_changes(self, k, steps, rate, change_time):
+        # the disturbances of ATC.simulate_random_attitude, drawn in the same order
+        stream = self.disturbance[k]
+        changes = np.zeros(steps)
+        time_to_change = change_time
+        for step in range(steps):
+            time_to_change -= dt * stream.next()
+            if time_to_change < 0:
+                changes[step] = rate * (stream.next() - 0.5) * 2
+                time_to_change = change_time
+        return changes
+
+    def simulate_random_attitude(self, start_error, error_change_rate, error_change_time, end_time):
+        """As simulate_static_attitude, but the error gets random kicks as in ATC.simulate_random_attitude"""
+        steps = self._end_steps(end_time)
+        rate = self._lanes(error_change_rate) * (np.pi / 180.0)
+        change_time = self._lanes(error_change_time)
+        error_change = self._lane_draws(steps, lambda k, n: self._random_changes(k, n, rate[k], change_time[k]))
+        return self._simulate(start_error, error_change, steps, self.atPID)
+
+
+def _zero_stats(time, speed, desc, units):
+    return ATC.ZeroStats(time, speed, desc, units)
+
+
+def _sweep_points(work):
+    scenario, pid, method, args, points, seed, early_exit = work
+    rows = []
+    for p, i, d in points:
+        atc = ATC.from_scenario(scenario)
+        atc.seed([seed] + np.array((p, i, d), float).view(np.uint32).tolist())
+        atc.early_exit = early_exit
+        getattr(atc, pid).setPID(p, i, d)
+        zero_stats = getattr(atc, method)(*args)[-1]
+        if zero_stats:
+            rows.append((p, i, d, zero_stats.time, zero_stats.speed, zero_stats.metric) + atc.metrics.row())
+        else:
+            rows.append((p, i, d, np.nan, np.nan, np.nan) + atc.metrics.row())
+    return rows
+
+
 gamedir = u'/media/user/Lir\'s/allis/AT_KSP_Plugins/KSP-test/'
 gamedir = u'/home/storage/Games/KSP_linux/PluginsArchives/Development/AT_KSP_Plugins/KSP-test/'
 game = u'KSP_test_1.3'
@@ -435,6 +763,7 @@ if __name__ == '__main__':
 
     wheels_ratio = 0.2
     AAs = 0.3, 0.7, 0.9, 1, 1.9, 3, 9, 20
+    bench_AAs = AAs
     # AAs = 1, 1.9, 3, 9
     AAs = 2,
     angles = 85, 25, 3
@@ -478,6 +807,13 @@ if __name__ == '__main__':
         atc.avPID.update(avErr)
         atc.avPID.action = avFilter.EWA(clamp(atc.avPID.action, -1, 1))
 
+    def steering_regime(atc):
+        if atc.InstantRatio > 0.7: return 'fast'
+        if atc.InstantRatio >= 0.005: return 'mixed'
+        return 'slow'
+
+    trace_steering = True
+
     def tune_steering(atc):
         """
         :param atc: attitude controller
@@ -486,18 +822,19 @@ if __name__ == '__main__':
         iErrf = 1 - abs(atc.error/np.pi)
         imaxAA = 1 / atc.MaxAA
         AM = atc.AV*atc.MoI
-        if atc.InstantRatio > 0.7:
+        regime = steering_regime(atc)
+        if regime == 'fast':
             tune_steering_fast(FastConfig, atc, iErrf, imaxAA, AM)
-        elif atc.InstantRatio >= 0.005:
+        elif regime == 'mixed':
             tune_steering_mixed(atc, iErrf, imaxAA, AM)
         else:
             tune_steering_slow(atc, iErrf, imaxAA, AM)
-        print ('time %f, atc.MaxAA %f, err %f, av %f, am %f, iErr %f\natPID %s\navPID %s' %
+        if trace_steering: print ('time %f, atc.MaxAA %f, err %f, av %f, am %f, iErr %f\natPID %s\navPID %s' %
                (atc.time, atc.MaxAA, atc.error / np.pi * 180, atc.AV / np.pi * 180, AM, iErrf, atc.atPID, atc.avPID))
 
     lever = 4
 
-    def simAA(error, maxAA, engine, base_thrust, wheels_ratio, error_rate=0, error_time=0):
+    def makeATC(maxAA, engine, base_thrust, wheels_ratio, on_update=None, rng=None):
         at_pid = PID2(1, 0.0, 1, 0, np.pi*10)
         av_pid = PID3(1, 0.0, 1, -1, 1, 3*dt)
         if wheels_ratio < 1:
@@ -507,16 +844,44 @@ if __name__ == '__main__':
             base_thrust = 0
             wheels_torque = engine.maxThrust*lever*2
             MoI = wheels_torque / maxAA
-        atc = ATC(engine, lever, MoI,
-                  at_pid, av_pid,
-                  base_thrust,
-                  tune_steering, wheels_torque)
+        return ATC(engine, lever, MoI,
+                   at_pid, av_pid,
+                   base_thrust,
+                   on_update, wheels_torque, rng)
+
+    def _simAA(error, maxAA, engine, base_thrust, wheels_ratio, error_rate, error_time, seed, on_update=tune_steering):
+        avFilter.cur = 0
+        atc = makeATC(maxAA, engine, base_thrust, wheels_ratio, on_update, seed)
         if error_rate > 0:
             if error_time > 0:
                 return atc.simulate_random_attitude(error, error_rate, error_time, clampL(error * 2, 60))
             return atc.simulate_linear_attitude(error, error_rate, clampL(error * 2, 60))
         return atc.simulate_static_attitude(error, clampL(error * 2, 60))
 
+    # simulations already run with the same configs, engine, scenario and code are loaded from here
+    store = ResultStore(code_files=[os.path.join(os.path.dirname(os.path.abspath(__file__)), f)
+                                    for f in (os.path.basename(__file__), 'common.py', 'Engine.py',
+                                              'Metrics.py', 'Recorder.py')],
+                        zero_stats=ATC.ZeroStats)
+
+    def simAA(error, maxAA, engine, base_thrust, wheels_ratio, error_rate=0, error_time=0, seed=0):
+        args = (error, maxAA, engine, base_thrust, wheels_ratio, error_rate, error_time, seed)
+        key = store.key('simAA', FastConfig, MixedConfig3plus, MixedConfig, SlowConfig, lever, args)
+        return store.cached(key, lambda: _simAA(*args), 'simAA', engine=engine.name,
+                            error=error, maxAA=maxAA, base_thrust=base_thrust, wheels_ratio=wheels_ratio,
+                            error_rate=error_rate, error_time=error_time, seed=seed)
+
+    def simMatrix(eng, AA, base_thrust, wheels_ratios, angles):
+        """Static attitude with untuned PIDs for every wheels ratio x angle x AA, run as a single ATCEnsemble"""
+        lanes = [(wr, ang, aa) for wr in wheels_ratios for ang in angles for aa in AA]
+        ensemble = ATCEnsemble([makeATC(aa, eng, base_thrust, wr) for wr, ang, aa in lanes])
+        results = ensemble.simulate_static_attitude([ang for wr, ang, aa in lanes],
+                                                    [clampL(ang * 2, 60) for wr, ang, aa in lanes])
+        cols = len(wheels_ratios) * len(angles)
+        for c in range(cols):
+            ATC.analyze_results(cols, c + 1, *results[c * len(AA):(c + 1) * len(AA)])
+        plt_show_maxed()
+
     def simAngle(eng, AA, base_thrust, wheels_ratio, error_rate, error_time, angles):
         if error_rate > 0:
             ATC.analyze_results(1, 1, *[simAA(0, aa, eng, base_thrust, wheels_ratio, error_rate, error_time) for aa in AA])
@@ -528,14 +893,155 @@ if __name__ == '__main__':
         fig.canvas.set_window_title(datetime.strftime(datetime.now(), '%H:%M:%S'))
         plt_show_maxed()
 
-    wheesly = Engine.from_file(datafile('Squad/Parts/Engine/jetEngines/jetEngineBasic.cfg'))
-    LV_T30 = Engine.from_file(datafile('Squad/Parts/Engine/liquidEngineLV-T30/liquidEngineLV-T30.cfg'))
+    # The tuning benchmark: static attitude for every engine x wheels ratio x AA x angle.
+    # The wheels ratios are those of IRt (the mixed regime) plus one for the fast
+    # and one for the slow regime; with an instant engine all cases are fast.
+    # Run it with 'benchmark' on the command line, and 'update' to store the new baseline.
+    bench_wheels_ratios = (0.8,) + tuple(ir for ir, _ in IRt) + (0.002,)
+    bench_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'tune_steering.csv')
+    bench_tolerances = {'zero_time': (0.05, 0.02), 'zero_speed': (1e-3, 0.05),
+                        'rise_time': (0.05, 0.02), 'settling_time': (0.05, 0.02),
+                        'overshoot': (1e-3, 0.05), 'IAE': (1e-3, 0.05),
+                        'runtime': (0.05, 0.5)}
+
+    def bench_case(engine, maxThrust, acceleration, deceleration, base_thrust, wheels_ratio, maxAA, angle, regime):
+        avFilter.cur = 0
+        atc = makeATC(maxAA, Engine(maxThrust, acceleration, deceleration), base_thrust, wheels_ratio,
+                      tune_steering, 0)
+        atc.early_exit = True
+        zero_stats = atc.simulate_static_attitude(angle, clampL(angle * 2, 60))[-1]
+        measured = dict(zip(Metrics.columns, atc.metrics.row()))
+        measured['zero_time'] = zero_stats.time if zero_stats else np.nan
+        measured['zero_speed'] = zero_stats.speed if zero_stats else np.nan
+        return measured
+
+    def bench_engines():
+        """(Engine, base_thrust) of the stored baseline, for when the game data are not available"""
+        table = load_baseline(bench_baseline)
+        engines = []
+        for name, group in table.groupby('engine', sort=False):
+            row = group.iloc[0]
+            engine = Engine(row.maxThrust, row.acceleration, row.deceleration)
+            engine.name = name
+            engines.append((engine, row.base_thrust))
+        return engines
+
+    def benchmark_tuning(engines, update=False):
+        global trace_steering
+        trace_steering = False
+        cases = []
+        for engine, base_thrust in engines:
+            for wr in bench_wheels_ratios:
+                for aa in bench_AAs:
+                    for ang in angles:
+                        cases.append(dict(case='%s wr %g AA %g %g deg' % (engine.name, wr, aa, ang),
+                                          engine=engine.name, maxThrust=engine.maxThrust,
+                                          acceleration=engine.acceleration, deceleration=engine.deceleration,
+                                          base_thrust=base_thrust, wheels_ratio=wr, maxAA=aa, angle=ang,
+                                          regime=steering_regime(makeATC(aa, engine, base_thrust, wr))))
+        return regression(cases, bench_case, bench_baseline, bench_tolerances, update)
+
+    def game_engine(filename):
+        path = datafile(filename)
+        return Engine.from_file(path) if os.path.isfile(path) else None
+
+    wheesly = game_engine('Squad/Parts/Engine/jetEngines/jetEngineBasic.cfg')
+    LV_T30 = game_engine('Squad/Parts/Engine/liquidEngineLV-T30/liquidEngineLV-T30.cfg')
 
     # np.random.seed(1)
-    wheesly.acceleration /= 2
-    wheesly.deceleration /= 2
+    if wheesly:
+        wheesly.acceleration /= 2
+        wheesly.deceleration /= 2
+
+    # The scenario runner: 'python ATC-sandbox.py run -h' for the parameters.
+    # Every combination of the parameters is simulated like by simAA, by the tuned
+    # PIDs or, with the 'fixed' model, by the initial ones as in simMatrix.
+    scenario_params = ('model', 'engine', 'AA', 'angle', 'error_rate', 'error_time',
+                       'wheels_ratio', 'base_thrust', 'seed')
+    scenario_defaults = dict(model='tuned', engine='wheesly', angle=0, error_rate=0, error_time=0,
+                             wheels_ratio=wheels_ratio, base_thrust=0.7, seed=0)
+
+    catalog = []
+
+    def engine_catalog():
+        if not catalog:
+            catalog.append(EngineCatalog(datafile('')))
+        return catalog[0]
+
+    def scenario_engine(spec):
+        """
+        An engine of the game_engines, of a part .cfg file, of a part of the GameData
+        by name or of a dict of Engine parameters
+        """
+        if isinstance(spec, dict):
+            engine = Engine(spec['maxThrust'], spec.get('acceleration', 0), spec.get('deceleration', 0))
+            engine.name = spec.get('name', engine.name)
+        elif spec in game_engines:
+            engine = game_engines[spec]
+        elif spec.endswith('.cfg'):
+            engine = Engine.from_file(spec if os.path.isfile(spec) else datafile(spec))
+        else:
+            engine = engine_catalog().engine(spec)
+        if engine is None:
+            raise ValueError('No engine: %s' % spec)
+        return engine
+
+    def scenario_key(case):
+        return store.key('scenario', FastConfig, MixedConfig3plus, MixedConfig, SlowConfig, lever,
+                         scenario_engine(case['engine']), sorted(case.items()))
+
+    def run_scenario(model, engine, AA, angle, error_rate, error_time, wheels_ratio, base_thrust, seed):
+        return _simAA(angle, AA, scenario_engine(engine), base_thrust, wheels_ratio, error_rate, error_time, seed,
+                      tune_steering if model == 'tuned' else None)
+
+    def run_scenarios_cli(argv):
+        global trace_steering
+        trace_steering = False
+        parser = arg_parser('Runs ATC scenarios headless; the parameters given here override those of the specs')
+        parser.add_argument('--model', nargs='+', choices=('tuned', 'fixed'))
+        parser.add_argument('--engine', nargs='+',
+                            help='%s, a part .cfg file or a part name' % ', '.join(sorted(game_engines)))
+        parser.add_argument('--AA', nargs='+', type=float, help='MaxAA, rad/s2')
+        parser.add_argument('--angle', nargs='+', type=float, help='start error, deg')
+        parser.add_argument('--error-rate', dest='error_rate', nargs='+', type=float, help='deg/s')
+        parser.add_argument('--error-time', dest='error_time', nargs='+', type=float,
+                            help='s between random error changes; 0 for the linear change')
+        parser.add_argument('--wheels-ratio', dest='wheels_ratio', nargs='+', type=float)
+        parser.add_argument('--base-thrust', dest='base_thrust', nargs='+', type=float)
+        parser.add_argument('--seed', nargs='+', type=int)
+        parser.add_argument('--no-cache', action='store_true', help='do not use the result store')
+        args = parser.parse_args(argv)
+        specs = [dict(scenario_defaults, **spec) for spec in specs_from_args(args, scenario_params)]
+        missing = [spec for spec in specs if 'AA' not in spec]
+        if missing:
+            parser.error('AA is not given')
+        cases = expand(specs)
+        # as long as the Recorder of the longest run, see _simAA
+        samples = int(max(clampL(case['angle'] * 2, 60) for case in cases) / dt / ATC.decimate) + 3
+        results = run_scenarios(cases, run_scenario, args.workers or None,
+                                None if args.no_cache else store, scenario_key, (4, samples))
+        write_results(args, cases, results, ('time', 'error', 'action', 'thrust'), min_band=0.1)
+        return 0
+
+    game_engines = {'wheesly': wheesly, 'LV-T30': LV_T30}
+    game_engines = dict((name, engine) for name, engine in game_engines.items() if engine)
+
+    if sys.argv[1:2] == ['run']:
+        sys.exit(run_scenarios_cli(sys.argv[2:]))
+
+    if 'benchmark' in sys.argv[1:]:
+        if wheesly and LV_T30:
+            engines = [(wheesly, 0.7), (LV_T30, 1)]
+        elif os.path.isfile(bench_baseline):
+            engines = bench_engines()
+        else:
+            sys.exit('No game data in %s to get the engines from, and no baseline at %s'
+                     % (datafile(''), bench_baseline))
+        sys.exit(0 if benchmark_tuning(engines, 'update' in sys.argv[1:]) else 1)
+
     # simAngle(wheesly, (0.2, 1, 2, 9, 19), 0.7, 0.01, 0, (45, 15, 3))
     simAngle(wheesly, AAs, 0.7, wheels_ratio, 10, 2, angles)
+    # simMatrix(wheesly, (0.3, 0.9, 3, 20), 0.7, (0, 0.2, 0.5), angles)
     # simAngle(wheesly, (0.5, 0.7, 0.9), 0.7, 0.02, 0, (45, 15, 3))
     # simAngle(wheesly, (0.5, 1, 2, 5, 10, 19), 0.7, 0.02, 0, (45, 15, 3))
     # simAngle(LV_T30, (0.009, 0.03, 0.1, 0.9, 1, 2, 10, 20), 1, 0.02, 0, (175, 60, 15, 3))
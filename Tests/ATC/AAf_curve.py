@@ -1,9 +1,9 @@
 from __future__ import print_function
-from scipy.optimize import curve_fit
 import pandas as pd
 import matplotlib.pyplot as plt
 
 from common import gamefile
+from fitting import fit_groups, plot_fits
 
 if __name__ == '__main__':
     df = pd.read_csv(gamefile('Tardigrade.AttitudeControl.csv'),
@@ -21,15 +21,9 @@ if __name__ == '__main__':
     pitch = df[df.axis == 1]
     roll = df[df.axis == 0].sort_values('AAy')
         
-    roll_opt, pcov = curve_fit(func, roll.AAy, roll.AAf)
-    print('roll', roll_opt)
-        
-    pitch_opt, pcov = curve_fit(func, pitch.AAx, pitch.AAf)
-    print('pitch', pitch_opt)
-
-    ax = roll.plot.scatter('AAy', 'AAf', c='r')
-    ax.plot(roll.AAy, func(roll.AAy, *roll_opt), 'r--')
-    pitch.plot.scatter('AAx', 'AAf', ax=ax)
-    ax.plot(pitch.AAx, func(pitch.AAx, *pitch_opt), '--')
+    groups = [('roll', roll.AAy, roll.AAf), ('pitch', pitch.AAx, pitch.AAf)]
+    fits = fit_groups(groups, func)
+    print(fits[['a', 'b', 'err_a', 'err_b', 'rss']])
 
+    plot_fits(fits, groups, func)
     plt.show()
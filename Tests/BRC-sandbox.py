@@ -1,11 +1,11 @@
 from __future__ import print_function
+import copy
 import numpy as np
 import matplotlib.pyplot as plt
 from multiprocessing import Pool, cpu_count
 
-from scipy.optimize import curve_fit
-
-from common import clampL, clampH, clamp01, lerp, PID, PID2, PID3, dt, center_deg, plt_show_maxed
+from common import clampL, clampH, clamp01, lerp, PID, PID2, PID3, PIDBank, PID3Bank, dt, center_deg, plt_show_maxed
+from fitting import fit_groups, coefficients
 
 if __name__ == '__main__':
     rad2deg = 180/np.pi
@@ -43,6 +43,8 @@ if __name__ == '__main__':
         steering = [0]
         bearing_pid.reset()
         av_pid.reset()
+        # PID3.reset keeps the derivative filter state
+        av_pid.filter.cur = 0
         tune_pids(maxAA, aaF)
         while time[-1] < max_t:
             bearing_action = bearing_pid.update(abs(angle[-1]) / 180)*np.sign(angle[-1])
@@ -53,7 +55,8 @@ if __name__ == '__main__':
             time.append(time[-1] + dt)
             # if draw:
                 # if abs(angle[-1]) < 0.01 and abs(av[-1]) < 0.01: break
-            if not draw and angle[-1] < 0: break
+            # stop at the zero crossing, or once the target is reached
+            if not draw and (angle[-1] < 0 or angle[-1] < 0.1 and abs(av[-1]) < 1e-3): break
         if draw: timelines(time,
                            np.array(needed_av, dtype=float)*rad2deg,
                            steering,
@@ -64,14 +67,82 @@ if __name__ == '__main__':
             return -1
 
 
+    def sym_lanes(angle, maxAA, aaF, max_t):
+        """
+        sym(angle, maxAA, aaF, max_t) for an array of aaF at once.
+        Each lane stops as sym does and is then dropped from the arrays.
+        :return: array of the results of sym, lane by lane
+        """
+        aaF = np.asarray(aaF, float)
+        bearing, steering = [], []
+        for f in aaF:
+            tune_pids(maxAA, f)
+            bearing.append(copy.copy(bearing_pid))
+            steering.append(copy.copy(av_pid))
+        bearing = PIDBank.from_pids(bearing)
+        steering = PID3Bank.from_pids(steering)
+        # each lane starts as sym does, with a clean derivative filter
+        steering.filter_cur[:] = 0
+        lanes = np.arange(len(aaF))
+        angle = np.full(len(aaF), float(angle))
+        av = np.zeros(len(aaF))
+        result = np.full(len(aaF), -1.0)
+        time = 0
+        while time < max_t and len(lanes):
+            bearing_action = bearing.update(np.abs(angle) / 180)*np.sign(angle)
+            steering.update(bearing_action - av)
+            av = av + steering.action * maxAA * dt
+            angle = center_deg(angle - av * dt * rad2deg)
+            time = time + dt
+            stop = (angle < 0) | (angle < 0.1) & (np.abs(av) < 1e-3)
+            if stop.any():
+                result[lanes[stop & (np.abs(av) < 1e-3)]] = time
+                keep = ~stop
+                lanes, angle, av = lanes[keep], angle[keep], av[keep]
+                bearing.compress(keep)
+                steering.compress(keep)
+        result[lanes[(angle < 0.1) & (np.abs(av) < 1e-3)]] = time
+        return result
+
+
+    def search_aaF(maxAA, max_aaF, steps=2000, edge_rtol=1e-3, angle=180, max_t=120):
+        """
+        The aaF of the minimum time to the target.
+        The time is not smooth in aaF: it drops sharply at the smallest aaF that
+        reaches the target and is noisy above it, so no bracketing search bounds it.
+        All 'steps' evenly spaced aaF are simulated at once by sym_lanes; as the
+        minimum is often right at that edge, the edge below the smallest of them
+        that reaches the target is then bisected by sym until the bracket is
+        edge_rtol of its upper end, about ten more simulations.
+        :return: (aaF, time, evaluations of sym); time is -1 if no aaF reaches the target
+        """
+        aaFs = np.linspace(0, max_aaF, steps)
+        times = sym_lanes(angle, maxAA, aaFs, max_t)
+        reached = np.flatnonzero(times > 0)
+        if not len(reached):
+            return max_aaF, -1, steps
+        # (time, aaF) of every simulation that reached the target
+        points = list(zip(times[reached], aaFs[reached]))
+        evaluations = steps
+        k = reached[0]
+        if k > 0:
+            lo, hi = aaFs[k - 1], aaFs[k]
+            while hi - lo > edge_rtol * hi:
+                mid = (lo + hi) / 2
+                time = sym(angle, maxAA, mid, max_t)
+                evaluations += 1
+                if time > 0:
+                    hi = mid
+                    points.append((time, mid))
+                else:
+                    lo = mid
+        best_time, best = min(points)
+        return best, best_time, evaluations
+
+
     def optimize((maxAA, max_aaF)):
-        print('Optimizing for MaxAA: {}'.format(maxAA))
-        best = max_aaF
-        best_time = -1
-        for aaF in np.linspace(0, max_aaF, 100):
-            time = sym(180, maxAA, aaF, 120)
-            if time > 0 and (best_time < 0 or time < best_time):
-                best = aaF
+        best, time, evaluations = search_aaF(maxAA, max_aaF)
+        print('MaxAA %f: aaF %f, time %f s, %d evaluations' % (maxAA, best, time, evaluations))
         return best
 
 
@@ -82,19 +153,20 @@ if __name__ == '__main__':
         mAA = np.arange(minAA, maxAA+0.01, 0.1)
         work = zip(mAA, [max_aaF]*300)
         pool = Pool(cpu_count())
-        aaF = pool.map(optimize, work)
-        try:
-            popt, pcov = curve_fit(AAf, mAA, aaF)
+        # each worker gets a contiguous chunk of maxAA; the aaF of a maxAA are simulated together by sym_lanes
+        aaF = pool.map(optimize, work, chunksize=-(-len(work) // cpu_count()))
+        fit = fit_groups([(max_aaF, mAA, aaF)], AAf)
+        plt.plot(mAA, aaF)
+        if fit.error[max_aaF] is None:
+            popt = coefficients(fit, max_aaF)
             print(bearing_pid)
             print(('AAf_a = %f\n'
                    'AAf_b = %f\n'
                    'AAf_c = %f\n') % tuple(popt))
             print('['+', '.join('%f' % c for c in popt)+']')
-            plt.plot(mAA, aaF)
             plt.plot(mAA, AAf(mAA, *popt))
-        except Exception as er:
-            print(str(er))
-            plt.plot(mAA, aaF)
+        else:
+            print(fit.error[max_aaF])
         plt.show()
 
 
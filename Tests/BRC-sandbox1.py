@@ -4,12 +4,15 @@ from datetime import datetime
 
 import numpy as np
 
+from Metrics import Metrics
+from PIDSearch import optimize_PID
+from Recorder import Recorder
 from Sandbox import Sandbox
 from common import dt, clampL, clampH, clamp, PID2, plt_show_maxed, Filter, PID3
 
 
 class BRC(Sandbox):
-    def __init__(self, wheels_torque, MoI, atPID, avPID, on_update=None):
+    def __init__(self, wheels_torque, MoI, atPID, avPID, on_update=None, rng=None):
         self.error = 0
         self.atPID = atPID
         self.avPID = avPID
@@ -20,6 +23,7 @@ class BRC(Sandbox):
         self.time = 0
         self.AV = 0
         self.AA = 0
+        self.seed(rng)
 
     @property
     def errorF(self):
@@ -30,14 +34,14 @@ class BRC(Sandbox):
         self.AA = 0
 
     def _error1(self, alpha):
-        return 1 - alpha + np.random.rand() * alpha * 2
+        return 1 - alpha + self.disturbance.next() * alpha * 2
 
     def _error2(self, alpha):
-        return (0.5 - np.random.rand()) * alpha * 2
+        return (0.5 - self.disturbance.next()) * alpha * 2
 
     def updateAV(self):
         self.AA = self.wheels * self.avPID.action / self.MoI
-        self.AV += self.AA * dt + (np.random.rand() - 0.5) * 1e-3
+        self.AV += self.AA * dt + (self.noise.next() - 0.5) * 1e-3
 
     def update(self):
         if self.on_update is not None:
@@ -53,10 +57,11 @@ class BRC(Sandbox):
 
     def simulate_constant_angular_velocity(self, needed_av, end_time, end_on_zero=False):
         self.time = 0
-        time = [0]
-        error = [needed_av]
-        action = [self.avPID.action]
+        rec = Recorder(('time', 'error', 'action'), end_time, decimate=self.decimate)
+        rec.record(0, needed_av, self.avPID.action)
+        prev_error = needed_av
         zero_stats = None
+        self.metrics = Metrics(needed_av, min_band=self.tenth_deg)
         self.reset()
         while self.time < end_time:
             self.time += dt
@@ -66,77 +71,85 @@ class BRC(Sandbox):
             else:
                 self.avPID.update(av_error)
             self.updateAV()
-            if not zero_stats and (av_error < self.tenth_deg or av_error * error[-1] < 0):
+            if not zero_stats and (av_error < self.tenth_deg or av_error * prev_error < 0):
                 zero_stats = self.ZeroStats(self.time, abs(self.AA), 'AA', 'rad/s2')
-            error.append(av_error)
-            action.append(self.avPID.action)
-            time.append(self.time)
-            if zero_stats and end_on_zero: break
-        return 'dAV [AA %.2f]' % self.MaxAA, time, np.fromiter(error, float)*self.rad2deg, action, (), zero_stats
+            prev_error = av_error
+            rec.record(self.time, av_error, self.avPID.action)
+            self.metrics.update(self.time, av_error, self.avPID.action)
+            if self._stop(zero_stats, end_on_zero): break
+        return 'dAV [AA %.2f]' % self.MaxAA, rec['time'], rec['error']*self.rad2deg, rec['action'], (), zero_stats
+
+    def _record_attitude(self, rec, prev_error, zero_stats):
+        if not zero_stats and (self.error < self.tenth_deg or self.error * prev_error < 0):
+            zero_stats = self.ZeroStats(self.time, abs(self.AV + self.AA * dt), 'AV', 'rad/s')
+        rec.record(self.time, self.error, self.avPID.action)
+        self.metrics.update(self.time, self.error, self.avPID.action)
+        return zero_stats
+
+    def _attitude_results(self, rec, zero_stats):
+        return 'dAng [AA %.2f]' % self.MaxAA, rec['time'], rec['error']*self.rad2deg, rec['action'], (), zero_stats
 
     def simulate_static_attitude(self, start_error, end_time, end_on_zero=False):
         self.error = start_error / 180.0 * np.pi
         self.time = 0
-        time = [0]
-        error = [self.error]
-        action = [self.avPID.action]
+        rec = Recorder(('time', 'error', 'action'), end_time, decimate=self.decimate)
+        rec.record(0, self.error, self.avPID.action)
         zero_stats = None
+        self.metrics = Metrics(self.error, min_band=self.tenth_deg)
         self.reset()
         while self.time < end_time:
             self.time += dt
+            prev_error = self.error
             self.update()
-            if not zero_stats and (self.error < self.tenth_deg or self.error * error[-1] < 0):
-                zero_stats = self.ZeroStats(self.time, abs(self.AV + self.AA * dt), 'AV', 'rad/s')
-            error.append(self.error)
-            action.append(self.avPID.action)
-            time.append(self.time)
-        return 'dAng [AA %.2f]' % self.MaxAA, time, np.fromiter(error, float)*self.rad2deg, action, (), zero_stats
+            zero_stats = self._record_attitude(rec, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return self._attitude_results(rec, zero_stats)
 
     def simulate_linear_attitude(self, start_error, error_change_rate, end_time, end_on_zero=False):
         self.error = start_error / 180.0 * np.pi
         error_change_rate *= np.pi / 180.0
         self.time = 0
-        time = [0]
-        error = [self.error]
-        action = [self.atPID.action]
+        rec = Recorder(('time', 'error', 'action'), end_time, decimate=self.decimate)
+        rec.record(0, self.error, self.atPID.action)
         zero_stats = None
+        self.metrics = Metrics(self.error, min_band=self.tenth_deg)
         self.reset()
         while self.time < end_time:
             self.time += dt
+            prev_error = self.error
             self.error += error_change_rate * dt
             self.update()
-            if not zero_stats and (self.error < self.tenth_deg or self.error * error[-1] < 0):
-                zero_stats = self.ZeroStats(self.time, abs(self.AV + self.AA * dt), 'AV', 'rad/s')
-            error.append(self.error)
-            action.append(self.avPID.action)
-            time.append(self.time)
-        return 'dAng [AA %.2f]' % self.MaxAA, time, np.fromiter(error, float)*self.rad2deg, action, (), zero_stats
+            zero_stats = self._record_attitude(rec, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return self._attitude_results(rec, zero_stats)
 
     def simulate_random_attitude(self, start_error, error_change_rate, error_change_time, end_time, end_on_zero=False):
         self.error = start_error / 180.0 * np.pi
         error_change_rate *= np.pi / 180.0
         time_to_change = error_change_time
         self.time = 0
-        time = [0]
-        error = [self.error]
-        action = [self.atPID.action]
+        rec = Recorder(('time', 'error', 'action'), end_time, decimate=self.decimate)
+        rec.record(0, self.error, self.atPID.action)
         zero_stats = None
+        self.metrics = Metrics(self.error, min_band=self.tenth_deg)
         self.reset()
         while self.time < end_time:
             self.time += dt
-            time_to_change -= dt * np.random.rand()
+            prev_error = self.error
+            time_to_change -= dt * self.disturbance.next()
             if time_to_change < 0:
-                self.error += error_change_rate * (np.random.rand() - 0.5) * 2
+                self.error += error_change_rate * (self.disturbance.next() - 0.5) * 2
                 time_to_change = error_change_time
             self.update()
-            if not zero_stats and (self.error < self.tenth_deg or self.error * error[-1] < 0):
-                zero_stats = self.ZeroStats(self.time, abs(self.AV + self.AA * dt), 'AV', 'rad/s')
-            error.append(self.error)
-            action.append(self.avPID.action)
-            time.append(self.time)
-        return 'dAng [AA %.2f]' % self.MaxAA, time, np.fromiter(error, float)*self.rad2deg, action, (), zero_stats
-
-    def optimize_av_PID(self, needed_av, aa_threshold, step, end_time, P, I, D):
+            zero_stats = self._record_attitude(rec, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return self._attitude_results(rec, zero_stats)
+
+    def optimize_av_PID(self, needed_av, aa_threshold, step, end_time, P, I, D, strategy=None):
+        if strategy is not None:
+            return optimize_PID(self.avPID, 'avPID',
+                                lambda: self.simulate_constant_angular_velocity(needed_av, end_time, True)[-1],
+                                aa_threshold, (P, I, D), strategy)
         best_pid = (1, 0, 0)
         best_stats = None
         for p in np.linspace(P[0], P[1], step):
@@ -173,7 +186,10 @@ class BRC(Sandbox):
             return best_pid
         return None
 
-    def optimize_at_PID(self, start_error, av_threshold, step, end_time, P, I, D):
+    def optimize_at_PID(self, start_error, av_threshold, step, end_time, P, I, D, strategy=None):
+        if strategy is not None:
+            return optimize_PID(self.atPID, 'atPID', lambda: self.simulate_static_attitude(start_error, end_time, True)[-1],
+                                av_threshold, (P, I, D), strategy)
         best_pid = (1, 0, 0)
         best_stats = None
         for p in np.linspace(P[0], P[1], step):
@@ -1,6 +1,14 @@
+import numpy as np
+
 from common import lerp, dt, clamp01
 from KSPUtils import Part, SearchTerm
 
+
+def cfg_flag(value):
+    """:return: the boolean of a config value, which is the string True or False"""
+    return str(value).strip().lower() == 'true'
+
+
 class Engine(object):
     def __init__(self, maxThrust, acceleration=0, deceleration=0):
         self.name = 'Engine'
@@ -54,7 +62,7 @@ class Engine(object):
         engine = engine[0]
         try:
             maxThrust = float(engine.GetValue('maxThrust'))
-            useResponse = bool(engine.GetValue('useEngineResponseTime'))
+            useResponse = cfg_flag(engine.GetValue('useEngineResponseTime'))
             accelSpeed = 0
             decelSpeed = 0
             if useResponse:
@@ -66,3 +74,76 @@ class Engine(object):
         e = Engine(maxThrust, accelSpeed, decelSpeed)
         e.name = p.name
         return e
+
+
+class EngineArray(object):
+    """
+    Many engines as arrays of their parameters and state.
+
+    update() is Engine.update of every element, with the same results;
+    the arrays may be of any shape, e.g. (engines,) of a multi-engine craft
+    or (2, lanes) of the front and rear engines of an ensemble of ATCs.
+    The lerp factors of the engine response are computed when acceleration
+    or deceleration is set.
+    """
+    def __init__(self, maxThrust, acceleration=0, deceleration=0, lever=1, limit=1, thrust=0):
+        arrays = np.broadcast_arrays(*[np.asarray(a, float) for a in
+                                       (maxThrust, acceleration, deceleration, lever, limit, thrust)])
+        self.maxThrust, acceleration, deceleration, self.lever, self.limit, self.thrust = [a.copy() for a in arrays]
+        self.acceleration = acceleration
+        self.deceleration = deceleration
+        self.torque = self.thrust*self.lever
+
+    @classmethod
+    def from_engines(cls, engines):
+        """:param engines: a sequence of Engines, or nested sequences for more dimensions"""
+        engines = np.array(engines, dtype=object)
+
+        def attr(name):
+            return np.vectorize(lambda e: getattr(e, name), otypes=[float])(engines)
+        return cls(attr('maxThrust'), attr('acceleration'), attr('deceleration'),
+                   attr('lever'), attr('limit'), attr('thrust'))
+
+    @property
+    def acceleration(self): return self._acceleration
+
+    @acceleration.setter
+    def acceleration(self, value):
+        self._acceleration = np.array(np.broadcast_to(np.asarray(value, float), self.maxThrust.shape))
+        self._lerp_up = clamp01(self._acceleration * dt)
+        self._instant_up = self._acceleration <= 0
+
+    @property
+    def deceleration(self): return self._deceleration
+
+    @deceleration.setter
+    def deceleration(self, value):
+        self._deceleration = np.array(np.broadcast_to(np.asarray(value, float), self.maxThrust.shape))
+        self._lerp_down = clamp01(self._deceleration * dt)
+        self._instant_down = self._deceleration <= 0
+
+    @property
+    def instant(self):
+        return self._instant_up & self._instant_down
+
+    @property
+    def shape(self): return self.maxThrust.shape
+
+    def __len__(self): return len(self.maxThrust)
+
+    def engine(self, index):
+        """:return: the Engine of the element at the index"""
+        e = Engine(self.maxThrust[index], self._acceleration[index], self._deceleration[index])
+        e.limit = self.limit[index]
+        e.thrust = self.thrust[index]
+        e.lever = self.lever[index]
+        e.torque = self.torque[index]
+        return e
+
+    def update(self):
+        request = self.maxThrust*self.limit
+        delta = request-self.thrust
+        up = delta > 0
+        self.thrust = np.where(np.where(up, self._instant_up, self._instant_down), request,
+                               self.thrust + delta * np.where(up, self._lerp_up, self._lerp_down))
+        self.torque = self.thrust*self.lever
@@ -0,0 +1,184 @@
+"""
+Index of the engines of a GameData tree.
+
+Engine.from_file parses a whole part config on every call. EngineCatalog
+scans every .cfg file of a GameData tree once, in a pool of processes,
+and keeps every engine module of every part found there in an index file.
+On later runs only the files whose mtime or size changed are parsed again,
+so loading an engine is a dict lookup by part name:
+    catalog = EngineCatalog(datafile(''))
+    wheesly = catalog.engine('JetEngine')
+"""
+
+from __future__ import print_function
+import hashlib
+import json
+import os
+from multiprocessing import Pool, cpu_count
+
+from Engine import Engine, cfg_flag
+
+
+def default_index(gamedata):
+    name = 'engines-%s.json' % hashlib.sha1(gamedata.encode('utf8')).hexdigest()[:12]
+    return os.path.join(os.path.expanduser('~'), '.cache', 'TCA-sandbox', name)
+
+
+def _value(node, name, default=None):
+    value = node.GetValue(name)
+    return default if value is None else value
+
+
+def scan_file(path):
+    """
+    :return: [(part, module, maxThrust, useEngineResponseTime,
+               engineAccelerationSpeed, engineDecelerationSpeed)]
+             of every engine module of every part in the file
+    """
+    from KSPUtils import Part
+    parts = Part.LoadFromFile(path)
+    records = []
+    for part in parts or ():
+        for module in Engine.module_term.select(part) or ():
+            try:
+                records.append((part.name, _value(module, 'name', ''),
+                                float(module.GetValue('maxThrust')),
+                                cfg_flag(_value(module, 'useEngineResponseTime', False)),
+                                float(_value(module, 'engineAccelerationSpeed', 0)),
+                                float(_value(module, 'engineDecelerationSpeed', 0))))
+            except (TypeError, ValueError):
+                continue
+    return records
+
+
+def _scan_files(work):
+    gamedata, files = work
+    results = []
+    for rel, stamp in files:
+        try:
+            records = scan_file(os.path.join(gamedata, rel))
+        except Exception as e:
+            print('%s: %s: %s' % (rel, type(e).__name__, e))
+            records = []
+        results.append((rel, stamp, records))
+    return results
+
+
+class EngineCatalog(object):
+    """
+    Engines of the part configs of a GameData tree, by part name.
+    :param gamedata: path to the GameData folder
+    :param index: the index file; default_index(gamedata) by default
+    :param workers: processes to scan the changed files with; None means cpu_count()
+    """
+    version = 1
+
+    def __init__(self, gamedata, index=None, workers=None):
+        self.gamedata = os.path.abspath(gamedata)
+        self.index = index or default_index(self.gamedata)
+        # relative path: [mtime, size, records]
+        self.files = {}
+        self.parts = {}
+        self._load()
+        self.update(workers)
+
+    def _load(self):
+        if not os.path.isfile(self.index):
+            return
+        with open(self.index) as f:
+            try:
+                data = json.load(f)
+            except ValueError:
+                return
+        if data.get('version') == self.version and data.get('gamedata') == self.gamedata:
+            self.files = data['files']
+
+    def _save(self):
+        dirname = os.path.dirname(self.index)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(self.index, 'w') as f:
+            json.dump({'version': self.version, 'gamedata': self.gamedata, 'files': self.files},
+                      f, separators=(',', ':'))
+
+    def _stamps(self):
+        stamps = {}
+        for root, _dirs, files in os.walk(self.gamedata):
+            for filename in files:
+                if filename.endswith('.cfg'):
+                    path = os.path.join(root, filename)
+                    st = os.stat(path)
+                    stamps[os.path.relpath(path, self.gamedata)] = [st.st_mtime, st.st_size]
+        return stamps
+
+    def update(self, workers=None):
+        """
+        Parses the configs that were added or changed since the index was written
+        and forgets the removed ones.
+        :return: the number of parsed files
+        """
+        stamps = self._stamps()
+        changed = sorted((rel, stamp) for rel, stamp in stamps.items()
+                         if rel not in self.files or self.files[rel][:2] != stamp)
+        removed = [rel for rel in self.files if rel not in stamps]
+        for rel in removed:
+            del self.files[rel]
+        if changed:
+            workers = min(workers or cpu_count(), len(changed))
+            size = -(-len(changed) // (workers * 4))
+            work = [(self.gamedata, changed[c:c+size]) for c in range(0, len(changed), size)]
+            if workers > 1:
+                pool = Pool(workers)
+                try:
+                    results = pool.map(_scan_files, work, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                results = [_scan_files(w) for w in work]
+            for rel, stamp, records in (r for chunk in results for r in chunk):
+                self.files[rel] = stamp + [records]
+        if changed or removed:
+            self._save()
+        self.parts = {}
+        for rel in sorted(self.files):
+            for record in self.files[rel][2]:
+                self.parts.setdefault(record[0], []).append([rel] + list(record[1:]))
+        return len(changed)
+
+    def __contains__(self, part):
+        return part in self.parts
+
+    def __len__(self):
+        return len(self.parts)
+
+    def names(self):
+        return sorted(self.parts)
+
+    def modules(self, part):
+        """:return: [(file, module, maxThrust, useEngineResponseTime, acceleration, deceleration)] of the part"""
+        return [tuple(r) for r in self.parts[part]]
+
+    @staticmethod
+    def _engine(part, maxThrust, useResponse, acceleration, deceleration):
+        e = Engine(maxThrust, acceleration if useResponse else 0, deceleration if useResponse else 0)
+        e.name = part
+        return e
+
+    def engine(self, part, module=0):
+        """
+        :return: a new Engine of the part's module, the first one by default,
+                 as Engine.from_file would load it; None if there is no such part
+        """
+        records = self.parts.get(part)
+        if not records or module >= len(records):
+            return None
+        return self._engine(part, *records[module][2:])
+
+    def from_file(self, path):
+        """:return: the first Engine of a part config of the catalog, as Engine.from_file"""
+        entry = self.files.get(os.path.relpath(os.path.abspath(path), self.gamedata))
+        if not entry or not entry[2]:
+            return None
+        record = entry[2][0]
+        return self._engine(record[0], *record[2:])
@@ -3,14 +3,17 @@ from datetime import datetime
 import numpy as np
 import matplotlib.pyplot as plt
 
-from common import dt, clampL, clampH, clamp, PID, PID2, plt_show_maxed, color_grad, Filter, PID3, lerp, clamp01
-from Engine import Engine
+from common import dt, clampL, clampH, clamp, PID, PID2, plt_show_maxed, color_grad, Filter, PID3, lerp, clamp01, \
+    pid_bank, PIDBank, noise_streams
+from Engine import Engine, EngineArray
+from Metrics import Metrics
+from Recorder import Recorder
 from Sandbox import Sandbox
 
 drag = 0.005
 
 class HSC(Sandbox):
-    def __init__(self, engine, pid, mass, turn_time, on_update=None):
+    def __init__(self, engine, pid, mass, turn_time, on_update=None, rng=None):
         self.angle = 0
         self.error = 0
         self.time = 0
@@ -28,6 +31,7 @@ class HSC(Sandbox):
         self.engine.thrust = self.engine.maxThrust*self.engine.limit
         self.PID.max = np.sqrt(1-self.base_limit**2)
         self.on_update = on_update
+        self.seed(rng)
 
     def update(self):
         if self.on_update is not None:
@@ -37,90 +41,240 @@ class HSC(Sandbox):
         self.angle = lerp(self.angle, np.arctan2(self.PID.action*np.sign(self.error), 1), self.turn_speed*dt)
         self.engine.limit = clamp01(self.base_limit/abs(np.cos(self.angle)))
         self.engine.update()
-        self.accel = self.engine.thrust*np.sin(self.angle)/self.mass + (np.random.rand()-0.5)*1e-3
+        self.accel = self.engine.thrust*np.sin(self.angle)/self.mass + (self.noise.next()-0.5)*1e-3
         self.error -= self.accel*dt
 
-    def simulate_constant_speed(self, start_error, end_time, end_on_zero=False):
-        self.error = start_error
+    def _start_recording(self, end_time):
         self.angle = 0
         self.time = 0
         self.accel = 0
-        time = [0]
-        error = [self.error]
-        action = [self.PID.action*np.sign(self.error)]
-        angle = [self.angle/np.pi*180]
+        rec = Recorder(('time', 'error', 'action', 'angle'), end_time, decimate=self.decimate)
+        rec.record(0, self.error, self.PID.action*np.sign(self.error), self.angle/np.pi*180)
+        self.metrics = Metrics(self.error, min_band=0.01)
+        return rec
+
+    def _record_speed(self, rec, prev_error, zero_stats):
+        if not zero_stats and (self.error < 0.01 or self.error*prev_error < 0):
+            zero_stats = self.ZeroStats(self.time, abs(self.accel), 'accel', 'm/s2')
+        rec.record(self.time, self.error, self.PID.action*np.sign(self.error), self.angle/np.pi*180)
+        self.metrics.update(self.time, self.error, self.PID.action)
+        return zero_stats
+
+    def _speed_results(self, rec, zero_stats):
+        if not zero_stats:
+            zero_stats = self.ZeroStats(self.time, abs(self.accel), 'accel', 'm/s2')
+        return ('dSpd [TT %.2f]' % self.turn_time, rec['time'],
+                rec['error'], rec['action'],
+                ((rec['angle'], 'angle'),), zero_stats)
+
+    def simulate_constant_speed(self, start_error, end_time, end_on_zero=False):
+        self.error = start_error
+        rec = self._start_recording(end_time)
         zero_stats = None
         while self.time < end_time:
             self.time += dt
+            prev_error = self.error
             self.update()
-            if not zero_stats and (self.error < 0.01 or self.error*error[-1] < 0):
-                zero_stats = self.ZeroStats(self.time, abs(self.accel), 'accel', 'm/s2')
-            error.append(self.error)
-            action.append(self.PID.action*np.sign(self.error))
-            angle.append(self.angle/np.pi*180)
-            time.append(self.time)
-        if not zero_stats:
-            zero_stats = self.ZeroStats(self.time, abs(self.accel), 'accel', 'm/s2')
-        return ('dSpd [TT %.2f]' % self.turn_time, time,
-                np.fromiter(error, float), action,
-                ((angle, 'angle'),), zero_stats)
+            zero_stats = self._record_speed(rec, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return self._speed_results(rec, zero_stats)
 
     def simulate_linear_speed(self, start_error, error_change_rate, end_time, end_on_zero=False):
         self.error = start_error
-        self.angle = 0
-        self.time = 0
-        self.accel = 0
-        time = [0]
-        error = [self.error]
-        action = [self.PID.action * np.sign(self.error)]
-        angle = [self.angle/np.pi*180]
+        rec = self._start_recording(end_time)
         zero_stats = None
         while self.time < end_time:
             self.time += dt
+            prev_error = self.error
             self.error += error_change_rate*dt
             self.update()
-            if not zero_stats and (self.error < 0.01 or self.error*error[-1] < 0):
-                zero_stats = self.ZeroStats(self.time, abs(self.accel), 'accel', 'm/s2')
-            error.append(self.error)
-            action.append(self.PID.action * np.sign(self.error))
-            angle.append(self.angle/np.pi*180)
-            time.append(self.time)
-        if not zero_stats:
-            zero_stats = self.ZeroStats(self.time, abs(self.accel), 'accel', 'm/s2')
-        return ('dSpd [TT %.2f]' % self.turn_time, time,
-                np.fromiter(error, float), action,
-                ((angle, 'angle'),), zero_stats)
+            zero_stats = self._record_speed(rec, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return self._speed_results(rec, zero_stats)
 
     def simulate_random_speed(self, start_error, error_change_rate, error_change_time, end_time, end_on_zero=False):
         time_to_change = error_change_time
-        self.error = start_error+error_change_rate * (np.random.rand() - 0.5) * 2
-        self.angle = 0
-        self.time = 0
-        self.accel = 0
-        time = [0]
-        error = [self.error]
-        action = [self.PID.action * np.sign(self.error)]
-        angle = [self.angle/np.pi*180]
+        self.error = start_error+error_change_rate * (self.disturbance.next() - 0.5) * 2
+        rec = self._start_recording(end_time)
         zero_stats = None
         while self.time < end_time:
             self.time += dt
-            time_to_change -= dt * np.random.rand()
+            prev_error = self.error
+            time_to_change -= dt * self.disturbance.next()
             if time_to_change < 0:
-                self.error += error_change_rate * (np.random.rand() - 0.5) * 2
+                self.error += error_change_rate * (self.disturbance.next() - 0.5) * 2
                 time_to_change = error_change_time
             self.update()
-            if not zero_stats and (self.error < 0.01 or self.error*error[-1] < 0):
-                zero_stats = self.ZeroStats(self.time, abs(self.accel), 'accel', 'm/s2')
-            error.append(self.error)
-            action.append(self.PID.action * np.sign(self.error))
-            angle.append(self.angle/np.pi*180)
-            time.append(self.time)
-        if not zero_stats:
-            zero_stats = self.ZeroStats(self.time, abs(self.accel), 'accel', 'm/s2')
-        return ('dSpd [TT %.2f]' % self.turn_time, time,
-                np.fromiter(error, float), action,
-                ((angle, 'angle'),), zero_stats)
+            zero_stats = self._record_speed(rec, prev_error, zero_stats)
+            if self._stop(zero_stats, end_on_zero): break
+        return self._speed_results(rec, zero_stats)
+
+
+class HSCEnsemble(object):
+    """
+    Lanes of horizontal speed controllers advanced together.
+
+    Lane k is HSC(engine[k], pid[k], mass[k], turn_time[k], on_update, rng[k]);
+    each argument is either a value for all the lanes or a sequence of them.
+    The PIDs, the turn, the engines and the dynamics are computed as arrays
+    over lanes, and lane k draws its noise from its own random streams,
+    so it reproduces the scalar simulation of that HSC exactly.
+    on_update, if given, is called with the ensemble and should work on arrays.
+    A lane whose mass is too great for its engine, where HSC asserts,
+    is masked out instead: valid[k] is False, and its result is None.
+    """
+    def __init__(self, engine, pid, mass, turn_time, on_update=None, rng=None):
+        args = [engine, pid, mass, turn_time, rng]
+        sizes = [len(a) for a in args if isinstance(a, (list, tuple, np.ndarray))]
+        self.lanes = max(sizes) if sizes else 1
+        engine, pid, mass, turn_time, rng = [list(a) if isinstance(a, (list, tuple, np.ndarray))
+                                             else [a] * self.lanes for a in args]
+        maxThrust = np.array([e.maxThrust for e in engine], float) * 4
+        mass = np.array(mass, float)
+        base_limit = mass * Sandbox.G / maxThrust
+        self.valid = base_limit < 1
+        keep = np.flatnonzero(self.valid)
+        self.size = len(keep)
+        self.mass = mass[keep]
+        self.mg = self.mass * Sandbox.G
+        self.base_limit = base_limit[keep]
+        self.turn_time = np.array(turn_time, float)[keep]
+        self.turn_speed = 1.0 / self.turn_time * np.log(10)
+        self.engines = EngineArray(maxThrust[keep], [engine[k].acceleration for k in keep],
+                                   [engine[k].deceleration for k in keep],
+                                   limit=self.base_limit, thrust=maxThrust[keep] * self.base_limit)
+        # with every lane masked there is nothing to control, and no PID type to bank
+        self.PID = pid_bank([pid[k] for k in keep]) if keep.size else PIDBank(0, 0, 0, 0, 0, n=0)
+        self.PID.max = np.sqrt(1 - self.base_limit ** 2)
+        self.noise, self.disturbance = zip(*[noise_streams(rng[k], 2) for k in keep]) if keep.size else ((), ())
+        self.on_update = on_update
+        self.error = np.zeros(self.size)
+        self.angle = np.zeros(self.size)
+        self.accel = np.zeros(self.size)
+        self.time = 0
 
+    @classmethod
+    def grid(cls, engine, pid, masses, turn_times, on_update=None, rng=None):
+        """
+        The ensemble of every mass x turn time; the results of a simulation
+        are in row-major order, e.g. np.reshape(zero_times, (len(masses), len(turn_times))).
+        """
+        mass, turn_time = np.meshgrid(masses, turn_times, indexing='ij')
+        return cls(engine, pid, mass.ravel(), turn_time.ravel(), on_update, rng)
+
+    def update(self, noise):
+        if self.on_update is not None:
+            self.on_update(self)
+        else:
+            self.PID.update(abs(self.error))
+        self.angle = lerp(self.angle, np.arctan2(self.PID.action*np.sign(self.error), 1), self.turn_speed*dt)
+        self.engines.limit = clamp01(self.base_limit/abs(np.cos(self.angle)))
+        self.engines.update()
+        self.accel = self.engines.thrust*np.sin(self.angle)/self.mass + (noise-0.5)*1e-3
+        self.error = self.error - self.accel*dt
+
+    def _lanes(self, value):
+        # a value per lane, as given to the constructor, of the valid lanes
+        value = np.array(np.broadcast_to(np.asarray(value, float), (self.lanes,)))
+        return value[self.valid]
+
+    def _end_steps(self, end_time):
+        # the number of steps of the scalar "while time < end_time: time += dt" loop
+        end_time = self._lanes(end_time)
+        steps = {}
+        for e in set(end_time):
+            time = 0
+            steps[e] = 0
+            while time < e:
+                time += dt
+                steps[e] += 1
+        return np.array([steps[e] for e in end_time], int)
+
+    def _lane_draws(self, steps, draw):
+        # draws steps[k] samples for lane k, padded to the longest lane
+        draws = np.zeros((steps.max() if self.size else 0, self.size))
+        for k in range(self.size):
+            draws[:steps[k], k] = draw(k, steps[k])
+        return draws
+
+    def _simulate(self, start_error, error_change, steps):
+        self.error = np.array(start_error, float)
+        self.angle = np.zeros(self.size)
+        self.accel = np.zeros(self.size)
+        self.time = 0
+        total = steps.max() if self.size else 0
+        noise = self._lane_draws(steps, lambda k, n: self.noise[k].take(n))
+        time = np.empty(total + 1)
+        error = np.empty((total + 1, self.size))
+        action = np.empty((total + 1, self.size))
+        angle = np.empty((total + 1, self.size))
+        time[0] = 0
+        error[0] = self.error
+        action[0] = self.PID.action*np.sign(self.error)
+        angle[0] = 0
+        zero_time = np.full(self.size, np.nan)
+        zero_accel = np.full(self.size, np.nan)
+        end_accel = np.abs(self.accel)
+        for step in range(1, total + 1):
+            self.time += dt
+            prev_error = self.error
+            if error_change is not None:
+                self.error = self.error + (error_change if error_change.ndim == 1 else error_change[step - 1])
+            self.update(noise[step - 1])
+            zero = (((self.error < 0.01) | (self.error * prev_error < 0)) &
+                    np.isnan(zero_time) & (steps >= step))
+            zero_time[zero] = self.time
+            zero_accel[zero] = np.abs(self.accel)[zero]
+            end = steps == step
+            end_accel[end] = np.abs(self.accel)[end]
+            time[step] = self.time
+            error[step] = self.error
+            action[step] = self.PID.action*np.sign(self.error)
+            angle[step] = self.angle/np.pi*180
+        results = [None] * self.lanes
+        for k, lane in enumerate(np.flatnonzero(self.valid)):
+            n = steps[k] + 1
+            if np.isnan(zero_time[k]):
+                zero_stats = Sandbox.ZeroStats(time[steps[k]], end_accel[k], 'accel', 'm/s2')
+            else:
+                zero_stats = Sandbox.ZeroStats(zero_time[k], zero_accel[k], 'accel', 'm/s2')
+            results[lane] = ('dSpd [TT %.2f]' % self.turn_time[k], time[:n],
+                             error[:n, k], action[:n, k], ((angle[:n, k], 'angle'),), zero_stats)
+        return results
+
+    def simulate_constant_speed(self, start_error, end_time):
+        """
+        :param start_error, end_time: scalars or sequences over lanes
+        :return: list of the HSC.simulate_constant_speed results of the lanes, None for the masked ones
+        """
+        return self._simulate(self._lanes(start_error), None, self._end_steps(end_time))
+
+    def simulate_linear_speed(self, start_error, error_change_rate, end_time):
+        """As simulate_constant_speed, but the error also changes at error_change_rate (per lane)"""
+        error_change = self._lanes(error_change_rate) * dt
+        return self._simulate(self._lanes(start_error), error_change, self._end_steps(end_time))
+
+    def _random_changes(self, k, steps, rate, change_time):
+        # the disturbances of HSC.simulate_random_speed after the first one, drawn in the same order
+        stream = self.disturbance[k]
+        changes = np.zeros(steps)
+        time_to_change = change_time
+        for step in range(steps):
+            time_to_change -= dt * stream.next()
+            if time_to_change < 0:
+                changes[step] = rate * (stream.next() - 0.5) * 2
+                time_to_change = change_time
+        return changes
+
+    def simulate_random_speed(self, start_error, error_change_rate, error_change_time, end_time):
+        """As simulate_constant_speed, but the error gets random kicks as in HSC.simulate_random_speed"""
+        steps = self._end_steps(end_time)
+        rate = self._lanes(error_change_rate)
+        change_time = self._lanes(error_change_time)
+        start_error = self._lanes(start_error) + np.array(
+            [rate[k] * (self.disturbance[k].next() - 0.5) * 2 for k in range(self.size)])
+        error_change = self._lane_draws(steps, lambda k, n: self._random_changes(k, n, rate[k], change_time[k]))
+        return self._simulate(start_error, error_change, steps)
 
 gamedir = u'/media/user/Lir\'s/allis/AT_KSP_Plugins/KSP-test/'
 gamedir = u'/home/storage/Games/KSP_linux/PluginsArchives/Development/AT_KSP_Plugins/KSP-test/'
@@ -135,14 +289,21 @@ def datafile(filename): return os.path.join(gamedir, game, gamedata, filename)
 
 if __name__ == '__main__':
 
-    def tune_pid(hsc):
+    def tune_gains(hsc):
         """
-        :param hsc: horizontal speed controller
-        :type hsc: HSC
+        :param hsc: horizontal speed controller, or an ensemble of them
+        :type hsc: HSC | HSCEnsemble
         """
         hsc.PID.P = 0.1/hsc.turn_time/(1+abs(hsc.accel))
         hsc.PID.D = 0.03*hsc.turn_time #*(1-clampH(abs(hsc.error)/hsc.turn_time*0.5, 1))
         hsc.PID.update2(abs(hsc.error), -hsc.accel)
+
+    def tune_pid(hsc):
+        """
+        :param hsc: horizontal speed controller
+        :type hsc: HSC
+        """
+        tune_gains(hsc)
         print ('time %f, TT %f, err %f, angle %f, accel %f\nPID %s' %
                (hsc.time, hsc.turn_time, hsc.error, hsc.angle, hsc.accel, hsc.PID))
 
@@ -170,6 +331,35 @@ if __name__ == '__main__':
         fig.canvas.set_window_title(datetime.strftime(datetime.now(), '%H:%M:%S'))
         plt_show_maxed()
 
+    def simGrid(eng, masses, TT, error, error_rate=0, error_time=0, seed=0):
+        """
+        Maps the zero time and acceleration over masses x turn times, run as a single HSCEnsemble;
+        the masses too great for the engine are left blank
+        """
+        pid = PID3(0.05, 0.0, 0.2, 0, 1, 0.1)
+        hsc = HSCEnsemble.grid(eng, pid, masses, TT, tune_gains, seed)
+        end_time = clampL(error * 2, 60)
+        if error_rate > 0:
+            if error_time > 0:
+                results = hsc.simulate_random_speed(error, error_rate, error_time, end_time)
+            else:
+                results = hsc.simulate_linear_speed(error, error_rate, end_time)
+        else:
+            results = hsc.simulate_constant_speed(error, end_time)
+        shape = (len(masses), len(TT))
+        zero_time = np.reshape([r[-1].time if r else np.nan for r in results], shape)
+        zero_accel = np.reshape([r[-1].speed if r else np.nan for r in results], shape)
+        for i, (values, title) in enumerate(((zero_time, 'zero time, s'), (zero_accel, 'accel at zero, m/s2'))):
+            plt.subplot(1, 2, i + 1)
+            plt.pcolormesh(np.arange(len(TT) + 1), np.arange(len(masses) + 1), np.ma.masked_invalid(values))
+            plt.xticks(np.arange(len(TT)) + 0.5, TT)
+            plt.yticks(np.arange(len(masses)) + 0.5, masses)
+            plt.xlabel('turn time, s')
+            plt.ylabel('mass, t')
+            plt.title(title)
+            plt.colorbar()
+        plt_show_maxed()
+
     wheesly = Engine.from_file(datafile('Squad/Parts/Engine/jetEngines/jetEngineBasic.cfg'))
     LV_T30 = Engine.from_file(datafile('Squad/Parts/Engine/liquidEngineLV-T30/liquidEngineLV-T30.cfg'))
 
@@ -177,4 +367,5 @@ if __name__ == '__main__':
     # wheesly.acceleration /= 2
     # wheesly.deceleration /= 2
     simAngle(wheesly, mass, TT, 1, 0, errors)
+    # simGrid(wheesly, (5, 10, 20, 30, 40, 60, 80), (0.5, 1, 1.5, 3, 6, 10), 15)
     # simAngle(LV_T30, mass, TT, 0, 2, errors)
@@ -0,0 +1,118 @@
+import numpy as np
+
+from common import dt
+
+
+class Model(object):
+    """
+    Interface of a model that can be advanced by the Integrator.
+
+    The state is a float array whose last axis holds the state variables;
+    leading axes, if any, are ensemble lanes, so derivative() should be
+    written with numpy operations over y[..., i] to work for both.
+    For the semi-implicit Euler method the state is ordered as
+    [positions..., velocities...]: y[..., split:] are advanced first,
+    then y[..., :split] are advanced using the updated velocities.
+    """
+    split = None
+
+    def derivative(self, t, y):
+        """:return: dy/dt, an array of the same shape as y"""
+        raise NotImplementedError()
+
+    def control(self, t, y):
+        """Called once at the start of every step; anything computed here is held for the step"""
+        pass
+
+    def constrain(self, t, y):
+        """Called after every (sub)step; may return a corrected copy of the state"""
+        return y
+
+
+def euler_step(model, t, y, h):
+    return y + model.derivative(t, y) * h
+
+
+def semi_implicit_step(model, t, y, h):
+    split = model.split if model.split is not None else y.shape[-1] // 2
+    y1 = y.copy()
+    y1[..., split:] += model.derivative(t, y)[..., split:] * h
+    y1[..., :split] += model.derivative(t, y1)[..., :split] * h
+    return y1
+
+
+def rk4_step(model, t, y, h):
+    h2 = h / 2.0
+    k1 = model.derivative(t, y)
+    k2 = model.derivative(t + h2, y + k1 * h2)
+    k3 = model.derivative(t + h2, y + k2 * h2)
+    k4 = model.derivative(t + h, y + k3 * h)
+    return y + (k1 + 2 * k2 + 2 * k3 + k4) * (h / 6.0)
+
+
+class Integrator(object):
+    """
+    Fixed-step integrator of a Model.
+
+    Each step of length 'step' calls model.control once and then advances
+    the state by 'substeps' steps of the chosen method, so the step of
+    the controller and the accuracy of the dynamics can be chosen independently.
+    """
+    methods = {'euler': euler_step,
+               'semi_implicit': semi_implicit_step,
+               'rk4': rk4_step}
+
+    def __init__(self, model, method='rk4', step=dt, substeps=1):
+        self.model = model
+        self.method = self.methods[method]
+        self.step_size = step
+        self.substeps = max(int(substeps), 1)
+        self.stop_time = None
+
+    def step(self, t, y):
+        """:return: the state at t+step"""
+        self.model.control(t, y)
+        h = self.step_size / self.substeps
+        for i in range(self.substeps):
+            y = self.model.constrain(t + (i + 1) * h, self.method(self.model, t + i * h, y, h))
+        return y
+
+    def run(self, y0, end_time=None, t0=0.0, stop=None):
+        """
+        Integrates from t0 until end_time is reached or stop(t, y) becomes true.
+        For an ensemble (y0 with leading lane axes) stop should return a boolean
+        array over the lanes; stopped lanes keep their state while the rest go on,
+        and the time each lane stopped at is stored in self.stop_time (NaN if it did not).
+        :return: (times, states) arrays; states has one row per time
+        """
+        y = np.array(y0, float)
+        lanes = y.shape[:-1]
+        self.stop_time = np.full(lanes, np.nan) if lanes else None
+        capacity = int((end_time - t0) / self.step_size) + 3 if end_time is not None else 1024
+        T = np.empty(capacity)
+        Y = np.empty((capacity,) + y.shape)
+        T[0], Y[0] = t0, y
+        n = 1
+        t = t0
+        active = None
+        while end_time is None or t < end_time:
+            if stop is not None:
+                done = stop(t, y)
+                if lanes:
+                    done = np.asarray(done, bool) & np.isnan(self.stop_time)
+                    self.stop_time[done] = t
+                    active = np.isnan(self.stop_time)
+                    if not active.any():
+                        break
+                elif done:
+                    self.stop_time = t
+                    break
+            y1 = self.step(t, y)
+            y = y1 if active is None else np.where(active[..., None], y1, y)
+            t += self.step_size
+            if n == len(T):
+                T = np.concatenate((T, np.empty(len(T))))
+                Y = np.concatenate((Y, np.empty(Y.shape)))
+            T[n], Y[n] = t, y
+            n += 1
+        return T[:n], Y[:n]
@@ -0,0 +1,81 @@
+import numpy as np
+
+from common import dt
+
+
+class Metrics(object):
+    """
+    Online step-response metrics of a simulation.
+
+    update() is called once per step with the error and the control action;
+    the error starts at error0 and should be driven to zero.
+        rise_time      the first time |error| fell to (1-rise) of |error0|
+        overshoot      the largest error of the sign opposite to error0
+        settling_time  the time since which |error| stays within the band
+        IAE, ITAE      integrals of |error| and of time*|error|
+        effort         integral of |action|
+    The band is 'band' of |error0|, but not narrower than min_band.
+    The run has settled when the error stayed within the band for 'hold' seconds,
+    and has diverged when |error| exceeded 'diverge' times the larger of the scale
+    and the band, or is not finite; update() returns True in either case,
+    so a simulation may stop early.
+    The scale is the expected error amplitude, |error0| by default; a run that starts
+    at zero error without a scale, e.g. one tracking a moving target, only diverges
+    when the error is not finite.
+    """
+    columns = ('rise_time', 'overshoot', 'settling_time', 'IAE', 'ITAE', 'effort')
+
+    def __init__(self, error0, band=0.02, min_band=0.0, hold=1.0, diverge=10.0, rise=0.9, scale=None):
+        self.error0 = error0
+        start = abs(error0)
+        self.sign = np.sign(error0)
+        self.band = max(band * start, min_band)
+        self.hold = hold
+        if scale is None:
+            scale = start
+        self.limit = diverge * max(scale, self.band) if scale else np.finfo(float).max
+        self.rise_level = (1 - rise) * start
+        self.time = 0
+        self.rise_time = None
+        self.overshoot = 0.0
+        self.settling_time = None
+        self.IAE = 0.0
+        self.ITAE = 0.0
+        self.effort = 0.0
+        self.settled = False
+        self.diverged = False
+
+    @property
+    def done(self):
+        return self.settled or self.diverged
+
+    def update(self, time, error, action):
+        e = abs(error)
+        self.time = time
+        self.IAE += e * dt
+        self.ITAE += time * e * dt
+        self.effort += abs(action) * dt
+        if self.rise_time is None and e <= self.rise_level:
+            self.rise_time = time
+        over = -self.sign * error
+        if over > self.overshoot:
+            self.overshoot = over
+        if e <= self.band:
+            if self.settling_time is None:
+                self.settling_time = time
+            self.settled = time - self.settling_time >= self.hold
+        else:
+            self.settling_time = None
+            self.settled = False
+        self.diverged = not e <= self.limit
+        return self.settled or self.diverged
+
+    def row(self):
+        """:return: values of the columns, NaN for the metrics that were not reached"""
+        return tuple(np.nan if v is None else v for v in (getattr(self, c) for c in self.columns))
+
+    def __str__(self):
+        return ('rise %s s, overshoot %f, settling %s s\n'
+                'IAE %f, ITAE %f, effort %f%s' %
+                (self.rise_time, self.overshoot, self.settling_time,
+                 self.IAE, self.ITAE, self.effort, ', diverged' if self.diverged else ''))
@@ -11,8 +11,10 @@ import matplotlib.pyplot as plt
 import matplotlib.lines as mlines
 import os
 
-from common import clamp, clamp01, clampH, clampL, lerp, dt, plt_show_maxed, vec, vec6, xzy, PID, PID2, color_grad, legend
+from common import clamp, clamp01, clampH, clampL, lerp, dt, plt_show_maxed, vec, vec6, xzy, PID, PID2, color_grad, legend, \
+    vFilter, series_filters, lagged_series, series_EWA, series_EWA2, VecArray
 from analyze_csv import loadCSV, addL
+from Integrator import Integrator, Model
 
 
 def draw_vectors(*vecs):
@@ -58,8 +60,10 @@ class engine(object):
     def vsf(self, K): return 1 if self.maneuver else K
 
 
-class VSF_sim(object):
+class VSF_sim(Model):
     t1 = 5.0
+    # state: upX, upV
+    split = 1
 
     def __init__(self, ter=None, AS=0, DS=0):
         self.Ter = list(ter) if ter is not None else None
@@ -142,22 +146,28 @@ class VSF_sim(object):
         self.upAF = -self.upA * 0.2 * self.upAF
         self.VSP = self.maxV + (2.0 + self.upAF) / self.twr
 
-    def phys_loop(self, on_frame=lambda: None):
+    def control(self, t, y):
+        self.update_upAF()
+        self.on_frame()
+        # VSF
+        self.K.append(self.vK)
+        # thrust
+        rthrust = self.thrust * self.K[-1]
+        speed = self.AS if rthrust > self.cthrust else self.DS
+        self.cthrust = lerp(self.cthrust, rthrust, speed * dt) if speed > 0 else rthrust
+        self.upA = (self.add_thrust + self.cthrust - self.M * 9.81) / self.M
+
+    def derivative(self, t, y):
+        return np.array([y[1], self.upA])
+
+    def phys_loop(self, on_frame=lambda: None, method='semi_implicit', substeps=1):
+        self.on_frame = on_frame
+        integrator = Integrator(self, method, dt, substeps)
         i = 1
         while self.dX >= 0 and (self.T[-1] < self.t1 or i < self.N):
             self.T.append(self.T[-1] + dt)
-            self.update_upAF()
-            on_frame()
-            # VSF
-            self.K.append(self.vK)
-            # thrust
-            rthrust = self.thrust * self.K[-1]
-            speed = self.AS if rthrust > self.cthrust else self.DS
-            self.cthrust = lerp(self.cthrust, rthrust, speed * dt) if speed > 0 else rthrust
             # dynamics
-            self.upA = (self.add_thrust + self.cthrust - self.M * 9.81) / self.M
-            self.upV += self.upA * dt
-            self.upX += self.upV * dt
+            self.upX, self.upV = integrator.step(self.T[-2], np.array([self.upX, self.upV]))
             self.dX = self.upX - (self.Ter[i] if self.N > 0 else 0)
             self.dV = EWA(self.dV, (self.dX - self.rX[-1]) / dt, 0.1)
             # logging
@@ -797,11 +807,9 @@ def EWA2(old, cur, ratio=0.7):
     return (1 - ratio) * old + ratio * cur
 
 
-def vFilter(v, flt, **kwargs):
-    f = [v[0]]
-    for val in v[:-1]:
-        f.append(flt(f[-1], val, **kwargs))
-    return np.fromiter(f, float)
+series_filters[Gauss] = lagged_series(lambda v, ratio=0.7, poles=2, cur=0.0: series_EWA(v, ratio ** poles, cur))
+series_filters[EWA] = lagged_series(lambda v, ratio=0.7, cur=0.0: series_EWA(v, ratio, cur))
+series_filters[EWA2] = lagged_series(lambda v, ratio=0.7, cur=0.0: series_EWA2(v, ratio, cur))
 
 
 def simFilters():
@@ -995,9 +1003,11 @@ def brake_sim():
     plt.show()
 
 
-class lambert_solver(object):
+class lambert_solver(Model):
     G = 6.674e-11
     Emu = 3.9860044189e14
+    # state: position, velocity
+    split = 3
 
     def __init__(self, r1, r2, t, mu=Emu):
         """
@@ -1116,19 +1126,20 @@ class lambert_solver(object):
             't ME:   %f s' % self.invtau(self.tauME),
             'vel:    %s m/s' % self.V])
 
-    def simulate(self, dt=0.01):
-        return self.simulate_generic(self.r1, self.V, self.transfer_time, dt)
-
-    def simulate_generic(self, r0, v0, end, dt=0.01):
-        t = [0]
-        r = [r0]
-        v = [v0]
-        while t[-1] <= end:
-            cr = r[-1]
-            r.append(cr + v[-1] * dt)
-            v.append(v[-1] - cr * self.mu / abs(cr) ** 3 * dt)
-            t.append(t[-1] + dt)
-        return t, r, v
+    def derivative(self, t, y):
+        r = y[..., :3]
+        d = np.empty_like(y)
+        d[..., :3] = y[..., 3:]
+        d[..., 3:] = -r * (self.mu / np.sqrt(np.sum(r * r, axis=-1)) ** 3)[..., None]
+        return d
+
+    def simulate(self, dt=0.01, method='euler', substeps=1):
+        return self.simulate_generic(self.r1, self.V, self.transfer_time, dt, method, substeps)
+
+    def simulate_generic(self, r0, v0, end, dt=0.01, method='euler', substeps=1):
+        t, y = Integrator(self, method, dt, substeps).run(np.concatenate((r0.v, v0.v)),
+                                                          stop=lambda _t, _y: _t > end)
+        return t, VecArray(y[:, :3]), VecArray(y[:, 3:])
 
 
 # ==================================================================#
@@ -0,0 +1,238 @@
+"""
+Search strategies for PID gains tuning.
+
+The objective is the one of the sandboxes' optimize_*_PID methods:
+a simulation with the given (p, i, d) yields ZeroStats (or None if the
+error never reached zero) and the best gains are those with the lowest
+ZeroStats.metric among the points whose speed at zero is below the threshold.
+
+Objective wraps such a simulation into a memoized function of a point,
+so a strategy may revisit points for free; the strategies only differ
+in the order and number of points they evaluate:
+    GridSearch    the exhaustive linspace cube
+    RefineGrid    successive grid refinement around the best points
+    NelderMead    scipy's Nelder-Mead simplex within the bounds
+    CrossEntropy  CMA-style sampling from a Gaussian fitted to the elite
+"""
+
+from __future__ import print_function
+import itertools
+from time import time as wall_time
+
+import numpy as np
+
+
+class Objective(object):
+    """
+    Memoized objective of the PID search.
+    evaluate(p, i, d) runs a simulation and returns its ZeroStats or None.
+    The value of a point is ZeroStats.metric if the speed at zero is below the threshold;
+    above it the metric is penalized proportionally to the excess speed,
+    and points that never reached zero are worth 'no_zero'.
+    """
+    no_zero = 1e6
+    penalty = 1e3
+
+    def __init__(self, evaluate, threshold):
+        self.evaluate = evaluate
+        self.threshold = threshold
+        self.memo = {}
+        self.evaluations = 0
+        self.best = None
+
+    def value(self, stats):
+        if not stats:
+            return self.no_zero
+        if stats.speed < self.threshold:
+            return stats.metric
+        return stats.metric + self.penalty * (stats.speed / self.threshold)
+
+    def __call__(self, point):
+        key = tuple(round(float(x), 12) for x in point)
+        if key in self.memo:
+            return self.memo[key][0]
+        stats = self.evaluate(*key)
+        self.evaluations += 1
+        value = self.value(stats)
+        self.memo[key] = (value, stats)
+        if stats and stats.speed < self.threshold and (self.best is None or value < self.memo[self.best][0]):
+            self.best = key
+        return value
+
+    def ranked(self):
+        """:return: the evaluated points from the lowest value to the highest, feasible or not"""
+        return sorted(self.memo, key=lambda k: (self.memo[k][0], k))
+
+
+def _axis(lo, hi, step):
+    return np.linspace(lo, hi, step) if lo != hi else np.array([float(lo)])
+
+
+def _bounds(bounds):
+    lo, hi = np.array(bounds, float).T
+    return lo, hi
+
+
+class GridSearch(object):
+    """The exhaustive linspace cube of the original optimizers"""
+    def __init__(self, step=10):
+        self.step = step
+
+    def search(self, objective, bounds):
+        for point in itertools.product(*[_axis(lo, hi, self.step) for lo, hi in bounds]):
+            objective(point)
+
+    def __str__(self):
+        return 'GridSearch(%d)' % self.step
+
+
+class RefineGrid(object):
+    """
+    Successive grid refinement: a coarse grid of 'coarse' points per axis
+    over the bounds, then 'levels' grids of 'step' points per axis around
+    each of the 'keep' best points found so far; every level halves
+    (by default) the size of these grids.
+    """
+    def __init__(self, coarse=6, step=3, levels=5, shrink=0.5, keep=5):
+        self.coarse = coarse
+        self.step = step
+        self.levels = levels
+        self.shrink = shrink
+        self.keep = keep
+
+    def search(self, objective, bounds):
+        lo0, hi0 = _bounds(bounds)
+        for point in itertools.product(*[_axis(lo, hi, self.coarse) for lo, hi in bounds]):
+            objective(point)
+        half = (hi0 - lo0) / max(self.coarse - 1, 1)
+        for _level in range(self.levels):
+            for center in objective.ranked()[:self.keep]:
+                lo = np.maximum(np.array(center) - half, lo0)
+                hi = np.minimum(np.array(center) + half, hi0)
+                for point in itertools.product(*[_axis(l, h, self.step) for l, h in zip(lo, hi)]):
+                    objective(point)
+            half = half * self.shrink
+
+    def __str__(self):
+        return 'RefineGrid(%d, %d, %d, %g, %d)' % (self.coarse, self.step, self.levels, self.shrink, self.keep)
+
+
+class NelderMead(object):
+    """
+    Nelder-Mead simplex search started from 'start' (the center of the bounds
+    by default) with the initial simplex spanning 'span' of the bounds.
+    Points outside the bounds are clipped to them.
+    """
+    def __init__(self, start=None, span=0.5, max_evaluations=200, xatol=1e-3, fatol=1e-3):
+        self.start = start
+        self.span = span
+        self.max_evaluations = max_evaluations
+        self.xatol = xatol
+        self.fatol = fatol
+
+    def search(self, objective, bounds):
+        from scipy.optimize import minimize
+        lo, hi = _bounds(bounds)
+        free = lo != hi
+        x0 = (lo + hi) / 2 if self.start is None else np.array(self.start, float)
+        if not free.any():
+            objective(x0)
+            return
+
+        def f(x):
+            point = x0.copy()
+            point[free] = np.clip(x, lo[free], hi[free])
+            return objective(point)
+
+        start = x0[free]
+        simplex = [start]
+        for j, size in enumerate((hi - lo)[free] * self.span):
+            vertex = start.copy()
+            vertex[j] += size if vertex[j] + size <= hi[free][j] else -size
+            simplex.append(vertex)
+        minimize(f, start, method='Nelder-Mead',
+                 options=dict(initial_simplex=np.array(simplex), maxfev=self.max_evaluations,
+                              xatol=self.xatol, fatol=self.fatol))
+
+    def __str__(self):
+        return 'NelderMead(%d)' % self.max_evaluations
+
+
+class CrossEntropy(object):
+    """
+    CMA-style population search: every generation samples 'population' points
+    from a Gaussian within the bounds and refits the Gaussian to the 'elite' best ones.
+    """
+    def __init__(self, population=12, elite=4, generations=8, seed=0):
+        self.population = population
+        self.elite = elite
+        self.generations = generations
+        self.seed = seed
+
+    def search(self, objective, bounds):
+        rnd = np.random.RandomState(self.seed)
+        lo, hi = _bounds(bounds)
+        mean = (lo + hi) / 2
+        std = (hi - lo) / 4
+        for _gen in range(self.generations):
+            points = np.clip(mean + std * rnd.randn(self.population, len(lo)), lo, hi)
+            values = np.array([objective(p) for p in points])
+            elite = points[np.argsort(values, kind='mergesort')[:self.elite]]
+            mean = elite.mean(axis=0)
+            std = elite.std(axis=0) + (hi - lo) * 1e-3
+
+    def __str__(self):
+        return 'CrossEntropy(%d, %d, %d)' % (self.population, self.elite, self.generations)
+
+
+class SearchResult(object):
+    def __init__(self, strategy, objective, time):
+        self.strategy = str(strategy)
+        self.evaluations = objective.evaluations
+        self.time = time
+        self.pid = objective.best
+        self.value, self.stats = objective.memo[self.pid] if self.pid else (None, None)
+
+    def __str__(self):
+        s = '%s: %d evaluations, %.2f s' % (self.strategy, self.evaluations, self.time)
+        if self.pid is None:
+            return s + '; nothing below the threshold'
+        return s + '; best %s metric %f' % (self.pid, self.value)
+
+
+def search(evaluate, threshold, bounds, strategy):
+    """
+    Runs the strategy on a new Objective(evaluate, threshold).
+    :param bounds: ((Pmin, Pmax), (Imin, Imax), (Dmin, Dmax))
+    :rtype: SearchResult
+    """
+    objective = Objective(evaluate, threshold)
+    start = wall_time()
+    strategy.search(objective, bounds)
+    return SearchResult(strategy, objective, wall_time() - start)
+
+
+def optimize_PID(pid, name, simulate, threshold, bounds, strategy):
+    """
+    Searches the gains of the pid for the optimize_*_PID methods of the sandboxes.
+    :param simulate: runs the simulation with the current gains of the pid and returns its ZeroStats
+    :return: the best (p, i, d), which are also set to the pid, or None
+    """
+    def evaluate(p, i, d):
+        pid.setPID(p, i, d)
+        return simulate()
+    result = search(evaluate, threshold, bounds, strategy)
+    print(result)
+    if result.pid is None:
+        return None
+    pid.setPID(*result.pid)
+    print('%s: %s\n%s\n' % (name, result.pid, result.stats))
+    return result.pid
+
+
+def compare(evaluate, threshold, bounds, *strategies):
+    """Runs each strategy on the same problem and prints the evaluations and wall time it took"""
+    results = [search(evaluate, threshold, bounds, s) for s in strategies]
+    for r in results:
+        print(r)
+    return results
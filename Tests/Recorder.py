@@ -0,0 +1,77 @@
+import numpy as np
+
+from common import dt
+
+
+class Recorder(object):
+    """
+    Time-series recorder for sandbox simulations.
+
+    Samples of all channels are stored as rows of a preallocated float array;
+    when the end time is known the whole run fits in a single buffer,
+    otherwise the recorder grows by chunks of chunk_size rows.
+    With decimate=N only every N-th call to record() is stored
+    (the first one always is).
+
+    Recorded channels are accessed by name as zero-copy views:
+    rec['time'], rec.columns('time', 'error'), rec.data (structured array).
+    """
+    def __init__(self, channels, end_time=None, step=dt, decimate=1, chunk_size=4096):
+        self.channels = tuple(channels)
+        self.index = dict((c, i) for i, c in enumerate(self.channels))
+        self.dtype = np.dtype([(c, float) for c in self.channels])
+        self.decimate = max(int(decimate), 1)
+        self.chunk_size = chunk_size
+        if end_time is not None:
+            capacity = int(end_time / step / self.decimate) + 3
+        else:
+            capacity = chunk_size
+        self._chunks = []
+        self._buf = np.empty((capacity, len(self.channels)))
+        self._size = 0
+        self._steps = 0
+
+    def __len__(self):
+        return sum(len(c) for c in self._chunks) + self._size
+
+    def record(self, *values):
+        step = self._steps
+        self._steps += 1
+        if step % self.decimate:
+            return
+        if self._size == len(self._buf):
+            self._chunks.append(self._buf)
+            self._buf = np.empty((self.chunk_size, len(self.channels)))
+            self._size = 0
+        self._buf[self._size] = values
+        self._size += 1
+
+    def _consolidate(self):
+        if self._chunks:
+            self._chunks.append(self._buf[:self._size])
+            self._buf = np.concatenate(self._chunks)
+            self._size = len(self._buf)
+            self._chunks = []
+
+    @property
+    def array(self):
+        """All recorded samples as a (samples x channels) float array view"""
+        self._consolidate()
+        return self._buf[:self._size]
+
+    @property
+    def data(self):
+        """All recorded samples as a structured array view with named fields"""
+        return self.array.view(self.dtype)[:, 0]
+
+    def last(self, channel):
+        if self._size:
+            return self._buf[self._size - 1, self.index[channel]]
+        return self._chunks[-1][-1, self.index[channel]]
+
+    def __getitem__(self, channel):
+        return self.array[:, self.index[channel]]
+
+    def columns(self, *channels):
+        arr = self.array
+        return tuple(arr[:, self.index[c]] for c in channels)
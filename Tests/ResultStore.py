@@ -0,0 +1,192 @@
+"""
+Persistent on-disk store of simulation results.
+
+Results are kept in an SQLite database, one row per key. A key is the sha1
+of everything a result depends on: the version of the sandbox code and the
+parts passed to key(), e.g. a tuning config class, an Engine, the scenario
+arguments and the seed. Classes and objects are fingerprinted by their public
+attributes, so changing a config or an engine parameter gives a new key,
+as does editing any of the code files the store was created with.
+
+Values are tuples of numbers, strings, numpy arrays and ZeroStats, i.e.
+the results of the simulate_* methods or the rows of a sweep; arrays are
+stored as an npz blob, the rest as JSON. Each row also has a kind and
+a JSON dict of metadata, so stored results can be listed with query()
+and compared without recomputing them.
+"""
+
+from __future__ import print_function
+import hashlib
+import io
+import json
+import os
+import sqlite3
+from time import time as wall_time
+
+import numpy as np
+
+
+def default_path():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'TCA-sandbox', 'results.sqlite')
+
+
+def code_version(*files):
+    """:return: sha1 of the contents of the files, in order"""
+    h = hashlib.sha1()
+    for filename in files:
+        with open(filename, 'rb') as f:
+            h.update(f.read())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+def fingerprint(obj):
+    """
+    JSON-able description of obj for the key of a result:
+    public non-callable attributes of classes and objects, lists of arrays
+    and the sha1 of byte strings; for the default of json.dumps.
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (np.floating, np.integer, np.bool_)):
+        return obj.item()
+    if isinstance(obj, bytes):
+        return hashlib.sha1(obj).hexdigest()
+    if isinstance(obj, type):
+        attrs = dict((k, v) for k, v in vars(obj).items()
+                     if not k.startswith('_') and not callable(v)
+                     and not isinstance(v, (staticmethod, classmethod, property)))
+        return {'class': obj.__name__, 'attrs': attrs}
+    if hasattr(obj, '__dict__'):
+        attrs = dict((k, v) for k, v in vars(obj).items()
+                     if not k.startswith('_') and not callable(v))
+        return {'type': type(obj).__name__, 'attrs': attrs}
+    if callable(obj):
+        return getattr(obj, '__name__', repr(obj))
+    raise TypeError('Cannot fingerprint %r' % (obj,))
+
+
+def _encode(value, arrays):
+    if isinstance(value, np.ndarray):
+        name = 'a%d' % len(arrays)
+        arrays[name] = value
+        return {'array': name}
+    if isinstance(value, (tuple, list)):
+        return [_encode(v, arrays) for v in value]
+    if isinstance(value, (np.floating, np.integer, np.bool_)):
+        return value.item()
+    if hasattr(value, 'speed') and hasattr(value, 'units'):
+        return {'zero_stats': [value.time, value.speed, value.desc, value.units]}
+    return value
+
+
+def _decode(value, arrays, zero_stats):
+    if isinstance(value, list):
+        return tuple(_decode(v, arrays, zero_stats) for v in value)
+    if isinstance(value, dict):
+        if 'array' in value:
+            return arrays[value['array']]
+        return zero_stats(*value['zero_stats'])
+    return value
+
+
+class ResultStore(object):
+    """
+    SQLite store of simulation results keyed by key(*parts).
+    :param path: the database file; default_path() by default
+    :param code_files: the sources the results depend on; their contents are part of every key
+    :param zero_stats: the class to rebuild ZeroStats with, e.g. ATC.ZeroStats
+    """
+    def __init__(self, path=None, code_files=(), zero_stats=None):
+        self.path = path or default_path()
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.version = code_version(*code_files)
+        self.zero_stats = zero_stats
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS results ('
+                        'key TEXT PRIMARY KEY, kind TEXT, version TEXT, '
+                        'meta TEXT, value TEXT, arrays BLOB, created REAL)')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, *parts):
+        """:return: the key of a result that depends on the parts and on the code version"""
+        data = json.dumps([self.version, parts], sort_keys=True, default=fingerprint)
+        return hashlib.sha1(data.encode('utf8')).hexdigest()
+
+    def __contains__(self, key):
+        return self.db.execute('SELECT 1 FROM results WHERE key=?', (key,)).fetchone() is not None
+
+    def get(self, key):
+        """:return: the stored value or None"""
+        row = self.db.execute('SELECT value, arrays FROM results WHERE key=?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, blob = row
+        arrays = {}
+        if blob is not None:
+            with np.load(io.BytesIO(bytes(blob))) as npz:
+                arrays = dict((name, npz[name]) for name in npz.files)
+        return _decode(json.loads(value), arrays, self.zero_stats)
+
+    def put(self, key, value, kind='', commit=True, **meta):
+        """Stores the value; with commit=False it is written by the next commit()"""
+        arrays = {}
+        value = json.dumps(_encode(value, arrays))
+        blob = None
+        if arrays:
+            buf = io.BytesIO()
+            np.savez_compressed(buf, **arrays)
+            blob = sqlite3.Binary(buf.getvalue())
+        self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (key, kind, self.version, json.dumps(meta, sort_keys=True, default=fingerprint),
+                         value, blob, wall_time()))
+        if commit:
+            self.db.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def cached(self, key, compute, kind='', **meta):
+        """:return: the stored value of the key, or compute() which is then stored"""
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = compute()
+        self.put(key, value, kind, **meta)
+        return value
+
+    def query(self, kind=None, current=False, **meta):
+        """
+        Lists the stored results whose metadata match the given values.
+        :param current: only the results of the current code version
+        :return: [(key, meta, created)] from the oldest to the newest
+        """
+        sql = 'SELECT key, version, meta, created FROM results'
+        args = ()
+        if kind is not None:
+            sql += ' WHERE kind=?'
+            args = (kind,)
+        results = []
+        for key, version, row_meta, created in self.db.execute(sql + ' ORDER BY created', args):
+            if current and version != self.version:
+                continue
+            row_meta = json.loads(row_meta)
+            if all(row_meta.get(k) == v for k, v in meta.items()):
+                results.append((key, row_meta, created))
+        return results
+
+    def load(self, kind=None, current=False, **meta):
+        """:return: [(meta, value)] of the results matching query(kind, current, **meta)"""
+        return [(row_meta, self.get(key)) for key, row_meta, _created in self.query(kind, current, **meta)]
+
+    def close(self):
+        self.db.close()
+
+    def __str__(self):
+        return '%s: %d hits, %d misses' % (self.path, self.hits, self.misses)
@@ -1,7 +1,10 @@
+import copy
+from functools import partial
+
 import numpy as np
-import matplotlib.pyplot as plt
 
-from common import color_grad
+from common import color_grad, pyplot, noise_streams
+from scenarios import stream_scenarios
 
 
 class Sandbox(object):
@@ -9,6 +12,9 @@ class Sandbox(object):
     twoPi = np.pi * 2
     tenth_deg = 0.1 / 180 * np.pi
     rad2deg = 180/np.pi
+    decimate = 1
+    # stop simulations once the error has settled or diverged, see Metrics
+    early_exit = False
 
     class ZeroStats(object):
         def __init__(self, time, speed, desc, units):
@@ -22,14 +28,65 @@ class Sandbox(object):
             return ('Zero at: %f s\n'
                     '%s: %f %s' % (self.time, self.desc, self.speed, self.units))
 
+        def __reduce__(self):
+            # a nested class is not picklable by reference in python2
+            return _zero_stats, (self.time, self.speed, self.desc, self.units)
+
+    def seed(self, seed=None):
+        """Restarts the random streams of the measurement noise and of the disturbances"""
+        self.noise, self.disturbance = noise_streams(seed, 2)
+
+    @classmethod
+    def run_batch(cls, scenarios, workers=1, sink=None, traces=(4, 0), slots=None):
+        """
+        Runs a scenario matrix of the sandbox, in this process or in a pool.
+        A scenario is a dict of the constructor arguments, plus 'method', the name
+        of a simulate_* method, and 'args', the tuple of its arguments;
+        scenarios.expand() makes the matrix of a spec with lists, e.g.
+            HSC.run_batch(expand([{'engine': wheesly, 'pid': pid, 'mass': [10, 30], 'turn_time': [0.5, 3],
+                                   'method': 'simulate_constant_speed', 'args': (15, 60)}]),
+                          workers=4, sink=SummarySink())
+        Every scenario is simulated by a new sandbox built from a copy of its arguments.
+        SummarySink and TraceSink need the standard (name, time, error, action, ..., zero_stats)
+        result of the simulate_* methods of HSC, BRC and the like; methods with other results,
+        such as GTurn.simulate, can only be run without a sink or with a sink of their own.
+        :param workers: number of processes; None means cpu_count(), 1 runs in this process
+        :param sink: sink(n, scenario, result, runtime), or a list of them, called with each result
+                     as soon as it is done, see scenarios.stream_scenarios; the results are not kept.
+                     Without a sink the results are returned.
+        :param traces, slots: see scenarios.stream_scenarios
+        :return: the sink, or the results in the order of the scenarios
+        """
+        if sink is None:
+            results = [None] * len(scenarios)
+
+            def collect(n, _scenario, result, _runtime):
+                results[n] = result
+            stream_scenarios(scenarios, partial(_run_sandbox, cls), collect, workers, traces, len(scenarios))
+            return results
+        sinks = sink if isinstance(sink, (list, tuple)) else [sink]
+
+        def fanout(*args):
+            for s in sinks:
+                s(*args)
+        stream_scenarios(scenarios, partial(_run_sandbox, cls), fanout, workers, traces, slots)
+        return sink
+
+    def _stop(self, zero_stats, end_on_zero):
+        # a settled run goes on until the zero is registered
+        return (end_on_zero and zero_stats or
+                self.early_exit and (self.metrics.diverged or self.metrics.settled and zero_stats))
+
     @staticmethod
     def _draw_grid(color):
+        plt = pyplot()
         plt.grid(b=False, which='major', axis='x', color=color, linestyle='-')
         plt.grid(b=False, which='minor', axis='x', color='0.15', linestyle='--')
         plt.grid(b=False, which='major', axis='y', color=color, linestyle='-')
 
     @classmethod
     def analyze_results(cls, cols, col, *results):
+        plt = pyplot()
         colors = color_grad(len(results)+1)
         gcolor = colors[-1]
         for i, result in enumerate(results):
@@ -54,3 +111,10 @@ class Sandbox(object):
                     plt.ylabel(ylab)
             plt.xlabel('time')
 
+
+def _zero_stats(time, speed, desc, units):
+    return Sandbox.ZeroStats(time, speed, desc, units)
+
+
+def _run_sandbox(cls, method, args=(), **init):
+    return getattr(cls(**copy.deepcopy(init)), method)(*args)
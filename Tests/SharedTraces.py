@@ -0,0 +1,89 @@
+"""
+Shared-memory transport of the traces of pool workers.
+
+Pool.map pickles the results of the workers back to the parent, and with
+the recorded traces of a simulation, hundreds of KB per run, that is most
+of the work of a parallel batch. SharedTraces is a float block of
+(slots x arrays x samples) values in shared memory, allocated by the parent
+before the pool is started and attached to every worker by its initializer:
+    traces = SharedTraces(len(cases), 4, samples)
+    pool = Pool(workers, attach, (traces,))
+A worker packs the result of slot n with pack(n, result): the 1-D float
+arrays found in the result, up to 'arrays' of them with up to 'samples'
+values each, are copied into the slot and replaced by {'trace': k}, so only
+the names, ZeroStats and the like are pickled. The parent unpacks the result
+into views of the block, without copying. Arrays that do not fit are pickled
+as before. The block lives as long as any of the views.
+"""
+
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+# the block of a pool worker, set by attach()
+_attached = None
+
+
+def attach(traces):
+    """Pool initializer: the block the worker packs its results into"""
+    global _attached
+    _attached = traces
+
+
+def pack(slot, value):
+    """:return: the value with its traces moved to the slot of the attached block, if any"""
+    if _attached is None:
+        return value
+    return _attached.pack(slot, value)
+
+
+class SharedTraces(object):
+    """
+    Shared block of the traces of 'slots' results, e.g. one slot per case.
+    :param arrays: the most arrays stored per slot
+    :param samples: the most values stored per array
+    """
+    def __init__(self, slots, arrays, samples):
+        self.shape = (slots, arrays, samples)
+        self._raw = RawArray('d', slots * arrays * (samples + 1))
+        self._map()
+
+    def _map(self):
+        slots, arrays, samples = self.shape
+        buf = np.frombuffer(self._raw, float)
+        self.data = buf[:slots * arrays * samples].reshape(self.shape)
+        self.lengths = buf[slots * arrays * samples:].reshape(slots, arrays)
+
+    def __getstate__(self):
+        # only while the pool is started: a RawArray is inherited, not sent
+        return self.shape, self._raw
+
+    def __setstate__(self, state):
+        self.shape, self._raw = state
+        self._map()
+
+    def pack(self, slot, value):
+        """:return: the value with the arrays that fit replaced by {'trace': k}"""
+        stored = [0]
+
+        def move(v):
+            if isinstance(v, (tuple, list)):
+                return type(v)(move(x) for x in v)
+            if (stored[0] < self.shape[1] and isinstance(v, np.ndarray) and
+                    v.ndim == 1 and v.dtype == float and len(v) <= self.shape[2]):
+                k = stored[0]
+                stored[0] += 1
+                self.data[slot, k, :len(v)] = v
+                self.lengths[slot, k] = len(v)
+                return {'trace': k}
+            return v
+        return move(value)
+
+    def unpack(self, slot, value):
+        """:return: the packed value with its traces as views of the block"""
+        if isinstance(value, (tuple, list)):
+            return type(value)(self.unpack(slot, v) for v in value)
+        if isinstance(value, dict) and list(value) == ['trace']:
+            k = value['trace']
+            return self.data[slot, k, :int(self.lengths[slot, k])]
+        return value
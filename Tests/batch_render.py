@@ -0,0 +1,97 @@
+"""
+Unattended rendering of sandbox and log-analysis figures.
+
+A report is a list of jobs; each job is (name, func, args[, kwargs]) where func
+draws one or more figures and usually ends with plt_show_maxed, e.g.
+(name, Sandbox.analyze_results, (cols, col) + results) or (name, drawDF, (df, 'L', columns)).
+Jobs are rendered by a pool of worker processes; each job's figures are saved
+to the output directory as <name>-<NN>.<format>, and index.html lists them all.
+So func and args should be picklable: module-level functions and plain data.
+"""
+
+from __future__ import print_function
+import os
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+from common import batch_figures, save_figures, pyplot
+
+
+def _render(work):
+    (name, func, args, kwargs), dirname, formats, size, dpi = work
+    batch_figures(dirname, formats, name, size, dpi)
+    error = None
+    try:
+        func(*args, **kwargs)
+        # save whatever was not shown by plt_show_maxed
+        save_figures()
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    finally:
+        # a failed job must not leave its figures to the next job of this worker
+        pyplot().close('all')
+    return name, [os.path.basename(f) for f in batch_figures(None)], error
+
+
+def _normalize(job):
+    if len(job) == 3:
+        return tuple(job) + ({},)
+    return tuple(job)
+
+
+def write_index(dirname, results, title='Figures'):
+    """Writes index.html listing the rendered figures job by job"""
+    html = ['<!DOCTYPE html>',
+            '<html><head><meta charset="utf-8"><title>%s</title></head><body>' % escape(title, True),
+            '<h1>%s</h1>' % escape(title, True),
+            '<p>%s</p>' % datetime.strftime(datetime.now(), '%Y-%m-%d %H:%M:%S'),
+            '<ul>']
+    html += ['<li><a href="#%s">%s</a></li>' % (escape(name, True), escape(name, True))
+             for name, _files, _error in results]
+    html.append('</ul>')
+    for name, files, error in results:
+        html.append('<h2 id="%s">%s</h2>' % (escape(name, True), escape(name, True)))
+        if error:
+            html.append('<p style="color:red">%s</p>' % escape(error, True))
+        for f in files:
+            if f.endswith('.png') or f.endswith('.svg'):
+                html.append('<p><a href="%s"><img src="%s" style="max-width:100%%"></a></p>' % (f, f))
+            else:
+                html.append('<p><a href="%s">%s</a></p>' % (f, f))
+    html.append('</body></html>')
+    index = os.path.join(dirname, 'index.html')
+    with open(index, 'w') as out:
+        out.write('\n'.join(html))
+    return index
+
+
+def render_batch(jobs, dirname, formats=('png',), workers=None, title='Figures', size=(16, 9), dpi=100):
+    """
+    Renders the jobs to files in dirname using a pool of worker processes.
+    :param jobs: iterable of (name, func, args[, kwargs]); names should be unique
+    :param formats: image formats, e.g. ('png', 'svg')
+    :param workers: number of worker processes; cpu_count() by default, 1 renders in this process
+    :return: path of the index page
+    """
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    work = [(_normalize(job), dirname, tuple(formats), size, dpi) for job in jobs]
+    workers = workers or cpu_count()
+    if workers > 1 and len(work) > 1:
+        pool = Pool(min(workers, len(work)))
+        try:
+            results = pool.map(_render, work, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_render(w) for w in work]
+    for name, _files, error in results:
+        if error:
+            print('%s failed: %s' % (name, error))
+    return write_index(dirname, results, title)
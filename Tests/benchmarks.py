@@ -0,0 +1,79 @@
+from __future__ import print_function
+import os
+import sys
+import timeit
+import subprocess
+
+import numpy as np
+
+from common import clamp, clampL, clampH, clamp01, lerp, center_deg, asymp01
+
+
+def _best(stmt, number, repeat=3):
+    return min(timeit.repeat(stmt, number=number, repeat=repeat)) / number
+
+
+def _report(name, scalar, array, size, loop=None):
+    line = '%-12s scalar % 8.3f us | array[%d] % 9.3f us (% 7.4f us/elem)' % (
+        name, scalar * 1e6, size, array * 1e6, array * 1e6 / size)
+    if loop is not None:
+        line += ' | python loop % 9.3f us (x%.0f)' % (loop * 1e6, loop / array)
+    print(line)
+
+
+def bench_clamp(size=100000, number=100000):
+    """Scalar and array paths of the clamp/lerp family"""
+    x = 0.3
+    a = np.random.rand(size) * 4 - 2
+    lst = list(a)
+    cases = (
+        ('clampL', lambda: clampL(x, 0.5), lambda: clampL(a, 0.5), lambda: [clampL(v, 0.5) for v in lst]),
+        ('clampH', lambda: clampH(x, 0.5), lambda: clampH(a, 0.5), lambda: [clampH(v, 0.5) for v in lst]),
+        ('clamp', lambda: clamp(x, -1, 1), lambda: clamp(a, -1, 1), lambda: [clamp(v, -1, 1) for v in lst]),
+        ('clamp01', lambda: clamp01(x), lambda: clamp01(a), lambda: [clamp01(v) for v in lst]),
+        ('lerp', lambda: lerp(x, 1.0, 0.1), lambda: lerp(a, 1.0, 0.1), lambda: [lerp(v, 1.0, 0.1) for v in lst]),
+        ('center_deg', lambda: center_deg(270.0), lambda: center_deg(a * 200),
+         lambda: [center_deg(v * 200) for v in lst]),
+        ('asymp01', lambda: asymp01(x), lambda: asymp01(a), lambda: [asymp01(v) for v in lst]),
+    )
+    print('clamp/lerp family:')
+    for name, scalar, array, loop in cases:
+        _report(name, _best(scalar, number), _best(array, 10), size, _best(loop, 1))
+
+
+_import_probe = '''
+import sys, time
+import numpy
+start = time.time()
+import %s
+print(time.time() - start)
+print(','.join(m for m in ('matplotlib', 'scipy', 'pandas') if m in sys.modules))
+'''
+
+
+def bench_import(module='common', budget=0.05, runs=5):
+    """
+    Measures the time of importing the module in a fresh interpreter
+    (numpy is imported beforehand, as it is needed by everything anyway)
+    and checks that it does not pull in plotting or scipy.
+    :return: True if the import is within the budget (seconds)
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    heavy = ''
+    for _i in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', _import_probe % module], cwd=here)
+        lines = out.decode().splitlines()
+        times.append(float(lines[0]))
+        heavy = lines[1] if len(lines) > 1 else ''
+    best = min(times)
+    ok = best <= budget and not heavy
+    print('import %s: %.1f ms (budget %.1f ms)%s -> %s' %
+          (module, best * 1e3, budget * 1e3, ', also imports ' + heavy if heavy else '', 'OK' if ok else 'FAIL'))
+    return ok
+
+
+if __name__ == '__main__':
+    ok = bench_import()
+    bench_clamp()
+    sys.exit(0 if ok else 1)
@@ -1,7 +1,8 @@
 import sys, os
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
+
+# matplotlib and scipy are heavy and are not needed by the math/PID code,
+# so they are imported on first use; see pyplot()
 
 dt = 0.02
 
@@ -12,41 +13,142 @@ game = 'KSP_test_1.4.1'
 def gamefile(filename): return os.path.join(gamedir, game, filename)
 
 
-def clampL(x, L): return x if x > L else L
+# The clamp/lerp family works with scalars and arrays alike:
+# python and numpy scalars take the cheap comparison path used in per-step
+# controller code; arrays (and lists, Series, etc.) are processed by numpy kernels
+# with the same semantics, element by element.
+_scalar_types = frozenset([float, int, bool, type(2 ** 64)] +
+                          [t for t in set(np.sctypeDict.values()) if issubclass(t, (np.number, np.bool_))])
+
 
+def clampL(x, L):
+    if type(x) in _scalar_types:
+        try:
+            return x if x > L else L
+        except ValueError:
+            pass
+    return np.fmax(x, L)
 
-def clampH(x, H): return x if x < H else H
+
+def clampH(x, H):
+    if type(x) in _scalar_types:
+        try:
+            return x if x < H else H
+        except ValueError:
+            pass
+    return np.fmin(x, H)
 
 
 def clamp(x, L, H):
-    if x > H: return H
-    elif x < L: return L
-    return x
+    if type(x) in _scalar_types:
+        try:
+            if x > H: return H
+            elif x < L: return L
+            return x
+        except ValueError:
+            pass
+    if type(L) in _scalar_types and type(H) in _scalar_types and L <= H:
+        return np.clip(x, L, H)
+    return np.where(np.greater(x, H), H, np.where(np.less(x, L), L, x))
 
 
 def clamp01(x):
-    if x > 1: return 1.0
-    elif x < 0: return 0.0
-    return x
+    if type(x) in _scalar_types:
+        if x > 1: return 1.0
+        elif x < 0: return 0.0
+        return x
+    return np.clip(x, 0.0, 1.0)
 
 
-vclamp01 = np.vectorize(clamp01)
+vclamp01 = clamp01
 
 
 def lerp(f, t, time): return f + (t - f) * clamp01(time)
 
 
 def center_deg(a):
-    a %= 360
-    if a > 180: a -= 360
-    return a
+    if type(a) in _scalar_types:
+        a %= 360
+        if a > 180: a -= 360
+        return a
+    # np.mod, not np.fmod: the result must take the sign of the divisor, as python's %
+    a = np.mod(a, 360)
+    return np.where(a > 180, a - 360, a)
 
 
 def asymp01(x, k=1):
     return 1.0 - 1.0 / (x / k + 1.0)
 
 
+def has_display():
+    if sys.platform.startswith('win') or sys.platform == 'darwin':
+        return True
+    return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+
+def pyplot():
+    """
+    Returns matplotlib.pyplot, importing it on first call.
+    If there's no display and no backend is requested by MPLBACKEND,
+    or if figures are saved to files (see batch_figures),
+    the non-interactive Agg backend is selected.
+    """
+    if 'matplotlib.pyplot' not in sys.modules:
+        import matplotlib
+        if _batch is not None or not has_display() and not os.environ.get('MPLBACKEND'):
+            matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+# batch mode settings; see batch_figures
+_batch = None
+
+
+def batch_figures(dirname, formats=('png',), prefix='figure', size=(16, 9), dpi=100):
+    """
+    Switches plt_show_maxed to batch mode: instead of showing figures
+    interactively, all open figures are saved to dirname as
+    <prefix>-<NN>.<format> for each of the formats and closed.
+    Passing None as dirname switches batch mode off.
+    :return: the list of files saved in the previous batch, if any
+    """
+    global _batch
+    saved = _batch['saved'] if _batch is not None else []
+    if dirname is None:
+        _batch = None
+        return saved
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    _batch = dict(dirname=dirname, formats=tuple(formats), prefix=prefix, size=size, dpi=dpi, count=0, saved=[])
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].switch_backend('Agg')
+    return saved
+
+
+def save_figures():
+    """
+    Saves all open figures according to batch_figures settings and closes them.
+    :return: list of the saved files
+    """
+    plt = pyplot()
+    saved = []
+    for num in plt.get_fignums():
+        fig = plt.figure(num)
+        fig.set_size_inches(*_batch['size'])
+        _batch['count'] += 1
+        for fmt in _batch['formats']:
+            filename = os.path.join(_batch['dirname'], '%s-%02d.%s' % (_batch['prefix'], _batch['count'], fmt))
+            fig.savefig(filename, dpi=_batch['dpi'])
+            saved.append(filename)
+        plt.close(fig)
+    _batch['saved'] += saved
+    return saved
+
+
 def fit_plot(xydata, model):
+    from scipy.optimize import curve_fit
+    plt = pyplot()
     data = np.array(xydata, float)
     xdata, ydata = data[:, 0], data[:, 1]
     opt, cov = curve_fit(model, xdata, ydata)
@@ -57,8 +159,12 @@ def fit_plot(xydata, model):
 
 
 def plt_show_maxed():
+    plt = pyplot()
     plt.tight_layout(pad=0, h_pad=0, w_pad=0)
     plt.subplots_adjust(top=0.99, bottom=0.03, left=0.05, right=0.99, hspace=0.25, wspace=0.1)
+    if _batch is not None:
+        save_figures()
+        return
     mng = plt.get_current_fig_manager()
     try:
         mng.window.showMaximized()
@@ -74,6 +180,7 @@ def plt_show_maxed():
 
 
 def legend():
+    plt = pyplot()
     plt.legend(bbox_to_anchor=(1.01, 1), loc=2, borderaxespad=0.)
 
 
@@ -113,6 +220,8 @@ class vec(object):
         return np.linalg.norm(self.v)
 
     def __add__(self, other):
+        if not isinstance(other, vec):
+            return NotImplemented
         return vec.from_array(self.v + other.v)
 
     def __iadd__(self, other):
@@ -122,6 +231,8 @@ class vec(object):
         return self
 
     def __sub__(self, other):
+        if not isinstance(other, vec):
+            return NotImplemented
         return vec.from_array(self.v - other.v)
 
     def __neg__(self):
@@ -134,7 +245,7 @@ class vec(object):
             return np.dot(self.v, other.v)
         elif isinstance(other, (int, float)):
             return vec.from_array(self.v * float(other))
-        raise TypeError('vec: unsupported multiplier type %s' % type(other))
+        return NotImplemented
 
     def __div__(self, other):
         return self * (1.0 / other)
@@ -168,6 +279,146 @@ class vec(object):
         return cls.from_array(np.random.rand(3) * 2 - 1).norm * magnitude
 
 
+class VecArray(object):
+    """
+    Contiguous N x 3 float64 array of vectors.
+    Mirrors vec arithmetic, but every operation is applied to all rows at once.
+    Operands may be VecArray, vec, or anything that broadcasts to (N, 3).
+    """
+    __array_priority__ = 1000
+
+    def __init__(self, a=None, n=0):
+        if a is None:
+            self.v = np.zeros((n, 3))
+        else:
+            self.v = np.ascontiguousarray(a, float).reshape(-1, 3)
+
+    @staticmethod
+    def _array(other):
+        if isinstance(other, (VecArray, vec)):
+            return other.v
+        return other
+
+    @staticmethod
+    def _column(other):
+        if isinstance(other, np.ndarray) and other.ndim == 1:
+            return other[:, None]
+        return other
+
+    @property
+    def xzy(self):
+        return VecArray(self.v[:, (0, 2, 1)])
+
+    @property
+    def norm(self):
+        return VecArray(self.v / self.magnitude()[:, None])
+
+    def magnitude(self):
+        return np.sqrt(np.einsum('ij,ij->i', self.v, self.v))
+
+    def __str__(self):
+        return '\n'.join('[%+.4f, %+.4f, %+.4f] |%.4f|' % (r[0], r[1], r[2], m)
+                         for r, m in zip(self.v, self.magnitude()))
+
+    def __repr__(self): return str(self)
+
+    def __len__(self): return self.v.shape[0]
+
+    def __iter__(self):
+        for row in self.v:
+            yield vec.from_array(row)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return vec.from_array(self.v[index])
+        return VecArray(self.v[index])
+
+    def __setitem__(self, index, value): self.v[index] = self._array(value)
+
+    def __abs__(self): return self.magnitude()
+
+    def __add__(self, other): return VecArray(self.v + self._array(other))
+
+    def __radd__(self, other): return self + other
+
+    def __iadd__(self, other):
+        self.v += self._array(other)
+        return self
+
+    def __sub__(self, other): return VecArray(self.v - self._array(other))
+
+    def __rsub__(self, other): return VecArray(self._array(other) - self.v)
+
+    def __isub__(self, other):
+        self.v -= self._array(other)
+        return self
+
+    def __neg__(self): return VecArray(-self.v)
+
+    def __rmul__(self, other): return self * other
+
+    def __mul__(self, other):
+        if isinstance(other, (VecArray, vec)):
+            return self.dot(other)
+        return VecArray(self.v * self._column(other))
+
+    def __imul__(self, other):
+        self.v *= self._column(other)
+        return self
+
+    def __div__(self, other): return VecArray(self.v / self._column(other))
+
+    def __idiv__(self, other):
+        self.v /= self._column(other)
+        return self
+
+    __truediv__ = __div__
+    __itruediv__ = __idiv__
+
+    def dot(self, other):
+        o = self._array(other)
+        if o.ndim == 1:
+            return self.v.dot(o)
+        return np.einsum('ij,ij->i', self.v, o)
+
+    def cross(self, other):
+        return VecArray(np.cross(self.v, self._array(other)))
+
+    def project(self, onto):
+        o = self._array(onto)
+        if o.ndim == 1:
+            return VecArray(np.outer(self.v.dot(o) / o.dot(o), o))
+        k = np.einsum('ij,ij->i', self.v, o) / np.einsum('ij,ij->i', o, o)
+        return VecArray(o * k[:, None])
+
+    def angle(self, other):
+        """
+        :rtype np.ndarray: radians
+        """
+        o = self._array(other)
+        om = np.linalg.norm(o) if o.ndim == 1 else np.sqrt(np.einsum('ij,ij->i', o, o))
+        return np.arccos(self.dot(o) / (self.magnitude() * om))
+
+    def cube_norm(self):
+        return VecArray(self.v / np.abs(self.v).max(axis=1)[:, None])
+
+    def normalize(self):
+        self.v /= self.magnitude()[:, None]
+        return self
+
+    def sum(self): return vec.from_array(self.v.sum(axis=0))
+
+    def to_vecs(self): return [vec.from_array(row) for row in self.v]
+
+    @classmethod
+    def from_vecs(cls, vecs):
+        return cls(np.array([v.v for v in vecs], float))
+
+    @classmethod
+    def rnd(cls, n, magnitude=1):
+        return cls(np.random.rand(n, 3) * 2 - 1).normalize() * magnitude
+
+
 class vec6(object):
     def __init__(self):
         self.positive = vec()
@@ -253,6 +504,7 @@ class PID(object):
                 act = sys.float_info.max
             V.append(V[-1] + act)
         # plot
+        plt = pyplot()
         V = np.array(V);
         SV = np.array(SV)
         plt.subplot(3, 1, 1)
@@ -310,10 +562,151 @@ class PID3(PID):
         return self.action
 
 
+class PIDBank(object):
+    """
+    N independent PID controllers updated in lock-step.
+    Every parameter and state variable is an array with one element per lane;
+    update/update2 take the error (and error speed) for all lanes at once
+    and follow PID semantics exactly, lane by lane.
+    """
+    def __init__(self, p, i, d, min_a, max_a, n=None):
+        arrays = np.broadcast_arrays(*[np.asarray(x, float) for x in (p, i, d, min_a, max_a)
+                                       + (() if n is None else (np.zeros(n),))])
+        self.P, self.I, self.D, self.min, self.max = [np.array(a, float, ndmin=1) for a in arrays[:5]]
+        self.reset()
+
+    @property
+    def size(self): return self.P.shape[0]
+
+    def __len__(self): return self.size
+
+    def setPID(self, p, i, d):
+        self.P[:] = p
+        self.I[:] = i
+        self.D[:] = d
+        self.reset()
+
+    def setFrom(self, pid):
+        self.P[:] = pid.P
+        self.I[:] = pid.I
+        self.D[:] = pid.D
+        self.reset()
+
+    def pack(self):
+        return np.column_stack([self.P, self.I, self.D])
+
+    def reset(self):
+        self.value = np.zeros_like(self.P)
+        self.ierror = np.zeros_like(self.P)
+        self.perror = np.zeros_like(self.P)
+        self.action = np.zeros_like(self.P)
+
+    def update(self, err):
+        err = np.asarray(err, float)
+        self.perror = np.where(self.perror == 0, err, self.perror)
+        return self.update2(err, (err - self.perror) / dt)
+
+    def update2(self, err, spd):
+        err = np.asarray(err, float)
+        ierror = np.where(self.ierror * err < 0, 0.0, self.ierror)
+        self.ierror = ierror + err * dt
+        act = self.P * err + self.I * self.ierror + self.D * spd
+        clamped = clamp(act, self.min, self.max)
+        self.ierror = np.where(clamped != act, ierror, self.ierror)
+        self.perror = err
+        self.action = clamped
+        return self.action
+
+    def compress(self, keep):
+        """Drops the lanes where the boolean array keep is False, with their state"""
+        for name, value in list(vars(self).items()):
+            if isinstance(value, np.ndarray) and value.shape[:1] == keep.shape:
+                setattr(self, name, value[keep])
+
+    def lane(self, idx):
+        """Returns a scalar controller with the current state of the given lane"""
+        pid = self._scalar_pid(idx)
+        pid.ierror = float(self.ierror[idx])
+        pid.perror = float(self.perror[idx])
+        pid.action = float(self.action[idx])
+        return pid
+
+    def _scalar_pid(self, idx):
+        return PID(self.P[idx], self.I[idx], self.D[idx], self.min[idx], self.max[idx])
+
+    @classmethod
+    def from_pids(cls, pids):
+        return cls(*zip(*[(p.P, p.I, p.D, p.min, p.max) for p in pids]))
+
+    def __str__(self, *args, **kwargs):
+        return '\n'.join(str(self.lane(i)) for i in range(self.size))
+
+
+class PID2Bank(PIDBank):
+    """Lock-step bank of PID2 controllers"""
+    def update2(self, err, spd):
+        err = np.asarray(err, float)
+        ierror = np.where(self.ierror * err < 0, 0.0, self.ierror)
+        d = self.D * spd
+        self.ierror = clamp(np.where(np.abs(d) < 0.6 * self.max, ierror + self.I * err * dt, 0.9 * ierror),
+                            self.min, self.max)
+        self.perror = err
+        self.action = clamp(self.P * err + self.ierror + d, self.min, self.max)
+        return self.action
+
+    def _scalar_pid(self, idx):
+        return PID2(self.P[idx], self.I[idx], self.D[idx], self.min[idx], self.max[idx])
+
+
+class PID3Bank(PIDBank):
+    """
+    Lock-step bank of PID3 controllers.
+    As in PID3, the derivative filter state survives reset().
+    """
+    def __init__(self, p, i, d, min_a, max_a, filter_tau, n=None):
+        super(PID3Bank, self).__init__(p, i, d, min_a, max_a, n)
+        self.filter_ratio = np.array(np.broadcast_to(dt / (np.asarray(filter_tau, float) + dt), self.P.shape))
+        self.filter_cur = np.zeros_like(self.P)
+
+    def update2(self, err, spd):
+        err = np.asarray(err, float)
+        ierror = np.where(self.ierror * err < 0, 0.0, self.ierror)
+        self.ierror = ierror + err * dt
+        self.filter_cur = self.filter_cur + (spd - self.filter_cur) * self.filter_ratio
+        act = self.P * err + self.I * self.ierror + self.D * self.filter_cur
+        clamped = clamp(act, self.min, self.max)
+        self.ierror = np.where(clamped != act, ierror, self.ierror)
+        self.action = clamped
+        self.perror = err
+        return self.action
+
+    def _scalar_pid(self, idx):
+        pid = PID3(self.P[idx], self.I[idx], self.D[idx], self.min[idx], self.max[idx], 0)
+        pid.filter.ratio = float(self.filter_ratio[idx])
+        pid.filter.cur = float(self.filter_cur[idx])
+        return pid
+
+    @classmethod
+    def from_pids(cls, pids):
+        bank = cls(*zip(*[(p.P, p.I, p.D, p.min, p.max, 0) for p in pids]))
+        bank.filter_ratio[:] = [p.filter.ratio for p in pids]
+        bank.filter_cur[:] = [p.filter.cur for p in pids]
+        return bank
+
+
+def pid_bank(pids):
+    """:return: the bank of the PID, PID2 or PID3 controllers, which should all be of the same type"""
+    for cls, bank in ((PID3, PID3Bank), (PID2, PID2Bank), (PID, PIDBank)):
+        if all(type(pid) is cls for pid in pids):
+            return bank.from_pids(pids)
+    raise ValueError('All lanes should use the same type of PID controller')
+
+
 class Filter(object):
     def __init__(self, ratio):
         self.ratio = ratio
         self.cur = 0
+        self.series_cur = None
 
     def setTau(self, tau):
         self.ratio = dt/(tau+dt)
@@ -342,14 +735,166 @@ class Filter(object):
             self.cur = new
             return self.cur
 
+    # whole-series versions; the filter state is carried over between calls,
+    # so a long series may be fed chunk by chunk. It is kept in series_cur,
+    # per column of the series, apart from the scalar cur it starts from;
+    # series_cur = None starts the next series from cur again
+    def _series_start(self):
+        return self.cur if self.series_cur is None else self.series_cur
+
+    def EWA_series(self, values):
+        res, self.series_cur = series_EWA(values, self.ratio, self._series_start())
+        return _like(values, res)
+
+    def Gauss_series(self, values, poles=2):
+        res, self.series_cur = series_Gauss(values, self.ratio, poles, self._series_start())
+        return _like(values, res)
+
+    def EWA2_series(self, values):
+        res, self.series_cur = series_EWA2(values, self.ratio, self._series_start())
+        return _like(values, res)
+
+    def stream(self, chunks, method='EWA', **kwargs):
+        """
+        Filters an iterable of chunks (arrays, Series or DataFrames with
+        the same columns) yielding filtered chunks, of the type of the input, as they come.
+        """
+        series = getattr(self, method + '_series')
+        for chunk in chunks:
+            yield series(chunk, **kwargs)
+
+
+def _like(block, values):
+    """:return: the values as a Series or DataFrame with the index of the block, if it is one"""
+    if hasattr(block, 'columns'):
+        return block.__class__(values, index=block.index, columns=block.columns)
+    if hasattr(block, 'index'):
+        return block.__class__(values, index=block.index, name=block.name)
+    return values
+
+
+def _series_state(x, cur):
+    return np.array(np.broadcast_to(np.asarray(cur, float), x.shape[1:]))
+
+
+def series_EWA(x, ratio, cur=0.0):
+    """
+    Filter.EWA applied to the whole series (along the first axis) by a single IIR pass.
+    :return: (filtered series, filter state after the last sample)
+    """
+    from scipy.signal import lfilter
+    x = np.asarray(x, float)
+    if not len(x):
+        return x.copy(), cur
+    cur = _series_state(x, cur)
+    y, _zf = lfilter([ratio], [1.0, ratio - 1.0], x, axis=0, zi=((1.0 - ratio) * cur)[None, ...])
+    return y, y[-1]
+
+
+def series_Gauss(x, ratio, poles=2, cur=0.0):
+    """
+    Filter.Gauss applied to the whole series.
+    Repeating the EWA step 'poles' times on the same sample is a single EWA step
+    with the ratio of 1-(1-ratio)^poles, so this is the same IIR pass as series_EWA.
+    """
+    return series_EWA(x, 1.0 - (1.0 - ratio) ** poles, cur)
+
+
+def _EWA2_scalar(x, y, start, end, up, down, cur):
+    for i in range(start, end):
+        new = x[i]
+        cur = cur + (new - cur) * (down if new < cur else up)
+        y[i] = cur
+    return cur
+
+
+def _EWA2_1d(x, ratio, cur):
+    from scipy.signal import lfilter
+    up = ratio
+    down = clamp01(1 - ratio)
+    n = len(x)
+    xl = x.tolist()
+    y = np.empty(n)
+    window = 64
+    i = 0
+    while i < n:
+        # speculatively filter a window assuming the branch of its first sample
+        # and accept everything up to the first sample that takes the other branch
+        end = min(n, i + window)
+        falling = x[i] < cur
+        r = down if falling else up
+        seg, _zf = lfilter([r], [1.0, r - 1.0], x[i:end], zi=[(1.0 - r) * cur])
+        prev = np.empty(end - i)
+        prev[0] = cur
+        prev[1:] = seg[:-1]
+        wrong = (x[i:end] < prev) != falling
+        k = int(np.argmax(wrong)) if wrong.any() else end - i
+        y[i:i + k] = seg[:k]
+        cur = seg[k - 1]
+        if k < 16:
+            # the branch flips too often for the IIR pass to pay off
+            i += k
+            end = min(n, i + 256)
+            cur = _EWA2_scalar(xl, y, i, end, up, down, cur)
+            i = end
+            window = 64
+        else:
+            window = min(window * 2, 65536) if k == end - i else max(window // 2, 64)
+            i += k
+    return y, cur
+
+
+def series_EWA2(x, ratio, cur=0.0):
+    """
+    Filter.EWA2 applied to the whole series.
+    The asymmetric filter is non-linear, so the series is split into runs
+    within which the branch does not change, and each run is filtered by
+    a single IIR pass.
+    """
+    x = np.asarray(x, float)
+    if not len(x):
+        return x.copy(), cur
+    cur = _series_state(x, cur)
+    if x.ndim == 1:
+        return _EWA2_1d(x, ratio, float(cur))
+    flat = x.reshape(len(x), -1)
+    y = np.empty_like(flat)
+    last = cur.reshape(-1).copy()
+    for c in range(flat.shape[1]):
+        y[:, c], last[c] = _EWA2_1d(flat[:, c], ratio, last[c])
+    return y.reshape(x.shape), last.reshape(x.shape[1:])
+
+
+# Whole-series implementations of two-argument filter functions
+# used with vFilter: {flt: series(v, **kwargs)}
+series_filters = {}
+
 
 def vFilter(v, flt, **kwargs):
+    series = series_filters.get(flt)
+    if series is not None:
+        return series(v, **kwargs)
     f = [v[0]]
     for val in v[:-1]:
         f.append(flt(f[-1], val, **kwargs))
     return np.fromiter(f, float)
 
 
+def lagged_series(series):
+    """
+    Adapts a series_* function to the vFilter convention:
+    f[0] = v[0], f[n] = flt(f[n-1], v[n-1])
+    """
+    def vseries(v, **kwargs):
+        v = np.asarray(v, float)
+        res = np.empty(len(v))
+        if len(v):
+            res[0] = v[0]
+            res[1:] = series(v[:-1], cur=v[0], **kwargs)[0]
+        return res
+    return vseries
+
+
 class SimpleKalman(object):
     def __init__(self, Q, R):
         self.Q = Q
@@ -372,3 +917,144 @@ class SimpleKalman(object):
         self._X = X + self._K * (measurement - X)
         self._P = (1 - self._K) * self._P
         return self._X
+
+
+class SimpleKalmanBank(object):
+    """
+    SimpleKalman for many channels at once.
+    Q, R and the X, P, K state are arrays with one element per channel.
+    update() takes either a single sample of all channels (1D array)
+    or a whole T x C block (2D array or DataFrame) and returns the filtered
+    values of the same shape; the state is carried over between calls,
+    so a log may be fed block by block.
+
+    The gain K does not depend on measurements and converges to Q/(Q+R);
+    while it changes, the filter is stepped in time over all channels at once,
+    after it settles (within rtol), each channel is filtered by a single IIR pass.
+    """
+    def __init__(self, Q, R, channels=None, rtol=1e-10):
+        self.Q = np.asarray(Q, float)
+        self.R = np.asarray(R, float)
+        self.rtol = rtol
+        self._X = None
+        self._P = None
+        self._K = None
+        self._steady = False
+        if channels is not None:
+            self._init(channels)
+
+    def _init(self, channels):
+        self.Q, self.R = [np.array(a) for a in np.broadcast_arrays(self.Q, self.R, np.zeros(channels))[:2]]
+        self._X = np.zeros(channels)
+        self._P = np.ones(channels)
+        self._K = np.ones(channels)
+        self._K_steady = self.Q / (self.Q + self.R)
+
+    @property
+    def value(self):
+        return self._X
+
+    @property
+    def channels(self):
+        return 0 if self._X is None else len(self._X)
+
+    def update(self, block):
+        m = np.asarray(block, float)
+        if m.ndim == 1:
+            return self.update(m[None, :])[0]
+        if self._X is None:
+            self._init(m.shape[1])
+        T = len(m)
+        X = np.empty_like(m)
+        n = 0
+        while n < T and not self._steady:
+            # time update
+            P = self._P + self.Q
+            # measurement update
+            self._K = P / (P + self.R)
+            self._X = self._X + self._K * (m[n] - self._X)
+            self._P = (1 - self._K) * self._P
+            X[n] = self._X
+            n += 1
+            self._steady = np.all(np.abs(self._K - self._K_steady) <= self.rtol * self._K_steady)
+        if n < T:
+            from scipy.signal import lfilter
+            for c, K in enumerate(self._K):
+                X[n:, c], _zf = lfilter([K], [1.0, K - 1.0], m[n:, c], zi=[(1.0 - K) * self._X[c]])
+            self._X = X[-1].copy()
+        if hasattr(block, 'columns'):
+            return block.__class__(X, index=block.index, columns=block.columns)
+        return X
+
+
+def make_rng(seed=None):
+    """
+    Random generator for the sandbox models: numpy.random.Generator where
+    available (numpy >= 1.17), RandomState otherwise.
+    A generator is returned as is; seed=None takes a seed from the global np.random,
+    so scripts that call np.random.seed() stay reproducible.
+    """
+    if isinstance(seed, np.random.RandomState) or hasattr(seed, 'bit_generator'):
+        return seed
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    if hasattr(np.random, 'default_rng'):
+        return np.random.default_rng(seed)
+    return np.random.RandomState(seed)
+
+
+def noise_streams(seed=None, n=1, block=4096):
+    """
+    n independent NoiseStreams derived from a single seed (an int, a tuple of ints
+    or a generator), e.g. one for the measurement noise and one for the disturbances of a model.
+    A generator is spawned where numpy can, otherwise the seed is drawn from it.
+    """
+    if isinstance(seed, np.random.RandomState) or hasattr(seed, 'bit_generator'):
+        if hasattr(seed, 'spawn'):
+            return [NoiseStream(rng, block) for rng in seed.spawn(n)]
+        draw = seed.randint if isinstance(seed, np.random.RandomState) else seed.integers
+        seed = draw(2 ** 31, size=4).tolist()
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    seed = list(seed) if isinstance(seed, (tuple, list)) else [seed]
+    if hasattr(np.random, 'SeedSequence'):
+        return [NoiseStream(np.random.default_rng(s), block) for s in np.random.SeedSequence(seed).spawn(n)]
+    return [NoiseStream(np.random.RandomState(seed + [k]), block) for k in range(n)]
+
+
+class NoiseStream(object):
+    """
+    Uniform [0, 1) samples of a random generator, drawn in blocks.
+    The sequence does not depend on the block size, so next() and take(n)
+    may be mixed freely: a model drawing one sample per step and an ensemble
+    taking all of them at once get the same numbers.
+    """
+    def __init__(self, rng=None, block=4096):
+        self.rng = make_rng(rng)
+        self.block = block
+        self._buf = []
+        self._pos = 0
+
+    def _draw(self, n):
+        if isinstance(self.rng, np.random.RandomState):
+            return self.rng.random_sample(n)
+        return self.rng.random(n)
+
+    def next(self):
+        pos = self._pos
+        self._pos = pos + 1
+        try:
+            return self._buf[pos]
+        except IndexError:
+            # python floats are much cheaper to index and to compute with in a scalar loop
+            self._buf = self._draw(self.block).tolist()
+            self._pos = 1
+            return self._buf[0]
+
+    def take(self, n):
+        """:return: an array of the next n samples"""
+        head = self._buf[self._pos:self._pos + n]
+        self._pos += len(head)
+        if len(head) == n:
+            return np.array(head, float)
+        return np.concatenate((np.array(head, float), self._draw(n - len(head))))
@@ -0,0 +1,175 @@
+"""
+Batch curve fitting of one model family over many datasets.
+
+Data are passed as groups: a dict {key: (xdata, ydata)}, an iterable of
+(key, xdata, ydata) or, for a DataFrame, df_groups(df, by, x, y).
+fit_groups() fits every group with scipy's curve_fit and returns a table
+with one row per group: the coefficients, their standard errors,
+the covariance matrix, the number of points, the residual sum of squares
+and the error message if the fit failed.
+
+Groups are fitted in order and each fit starts from the solution of the
+previous one, so neighbouring groups (e.g. sorted by MaxAA) converge fast;
+with several workers the groups are split into contiguous runs, one per
+process. For a pool the model must be picklable, i.e. a module-level function.
+Plotting is separate: plot_fits(table, groups, model).
+"""
+
+from __future__ import print_function
+import hashlib
+import inspect
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from common import pyplot, color_grad
+
+
+def df_groups(df, by, x, y):
+    """:return: [(key, xdata, ydata)] for each group of df.groupby(by), sorted by key"""
+    return [(key, g[x].values, g[y].values) for key, g in df.groupby(by)]
+
+
+def _normalize(groups):
+    if isinstance(groups, dict):
+        groups = sorted(groups.items(), key=lambda kv: kv[0])
+        groups = [(key, xy[0], xy[1]) for key, xy in groups]
+    return [(key, np.asarray(x, float), np.asarray(y, float)) for key, x, y in groups]
+
+
+def param_names(model, n=None):
+    """Names of the model parameters, i.e. of all its arguments but the first"""
+    try:
+        args = inspect.getfullargspec(model).args
+    except AttributeError:
+        args = inspect.getargspec(model).args
+    names = args[1:]
+    if n is not None and len(names) != n:
+        names = ['p%d' % i for i in range(n)]
+    return names
+
+
+def _model_id(model):
+    code = getattr(model, '__code__', None)
+    if code is None:
+        return repr(model).encode()
+    return (code.co_name + repr(code.co_consts)).encode() + code.co_code
+
+
+def data_hash(model, x, y, p0=None, **kwargs):
+    """Cache key of the fit: the model code, the data, the initial guess and curve_fit options"""
+    h = hashlib.sha1(_model_id(model))
+    h.update(np.ascontiguousarray(x, float).tobytes())
+    h.update(b'|')
+    h.update(np.ascontiguousarray(y, float).tobytes())
+    h.update(repr(None if p0 is None else list(p0)).encode())
+    h.update(repr(sorted(kwargs.items())).encode())
+    return h.hexdigest()
+
+
+def _fit_run(work):
+    model, run, p0, warm_start, kwargs = work
+    from scipy.optimize import curve_fit
+    results = []
+    start = p0
+    for key, x, y in run:
+        opt = cov = error = None
+        for guess in ((start, p0) if start is not p0 else (p0,)):
+            try:
+                opt, cov = curve_fit(model, x, y, p0=guess, **kwargs)
+                error = None
+                break
+            except Exception as e:
+                error = '%s: %s' % (type(e).__name__, e)
+        if warm_start and opt is not None:
+            start = opt
+        rss = np.nan if opt is None else float(np.sum((y - model(x, *opt)) ** 2))
+        results.append((key, opt, cov, rss, error))
+    return results
+
+
+def _split(items, n):
+    size = -(-len(items) // n)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def fit_groups(groups, model, p0=None, workers=1, warm_start=True, cache=None, **kwargs):
+    """
+    Fits the model to each group of data.
+    :param groups: {key: (xdata, ydata)}, or [(key, xdata, ydata)] in the order of fitting
+    :param model: f(x, *params) as for curve_fit
+    :param p0: initial guess for the first group and the fallback if a warm start fails
+    :param workers: number of worker processes; None means cpu_count()
+    :param warm_start: start each fit from the previous group's solution
+    :param cache: a dict-like {data_hash: (opt, cov, rss, error)}; hits are not refitted
+                  and new results are stored in it
+    :param kwargs: passed to curve_fit, e.g. bounds or maxfev
+    :return: pandas DataFrame indexed by group key
+    """
+    import pandas as pd
+    groups = _normalize(groups)
+    keys = [data_hash(model, x, y, p0, **kwargs) if cache is not None else None
+            for _key, x, y in groups]
+    cached = [h is not None and h in cache for h in keys]
+    todo = [g for g, hit in zip(groups, cached) if not hit]
+    workers = workers or cpu_count()
+    runs = _split(todo, workers) if todo else []
+    work = [(model, run, p0, warm_start, kwargs) for run in runs]
+    if len(work) > 1:
+        pool = Pool(len(work))
+        try:
+            fitted = pool.map(_fit_run, work, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        fitted = [_fit_run(w) for w in work]
+    fitted = iter([r for run in fitted for r in run])
+    rows = []
+    names = None
+    for (key, x, _y), h, hit in zip(groups, keys, cached):
+        if hit:
+            opt, cov, rss, error = cache[h]
+        else:
+            _key, opt, cov, rss, error = next(fitted)
+            if h is not None:
+                cache[h] = (opt, cov, rss, error)
+        rows.append((key, opt, cov, len(x), rss, error))
+        if names is None and opt is not None:
+            names = param_names(model, len(opt))
+    if names is None:
+        names = param_names(model) if p0 is None else param_names(model, len(p0))
+    nan = [np.nan] * len(names)
+    table = pd.DataFrame([list(opt if opt is not None else nan) +
+                          list(np.sqrt(np.diag(cov)) if cov is not None else nan) +
+                          [cov, n, rss, error]
+                          for _key, opt, cov, n, rss, error in rows],
+                         index=[r[0] for r in rows],
+                         columns=names + ['err_' + p for p in names] + ['cov', 'n', 'rss', 'error'])
+    table.index.name = 'group'
+    return table
+
+
+def coefficients(table, key):
+    """:return: the fitted parameters of the group as an array"""
+    return table.loc[key, [c for c in table.columns if 'err_' + c in table.columns]].values.astype(float)
+
+
+def plot_fits(table, groups, model, ncols=None):
+    """Draws the data and the fitted curve of every group on a grid of subplots"""
+    plt = pyplot()
+    groups = _normalize(groups)
+    n = len(groups)
+    ncols = ncols or int(np.ceil(np.sqrt(n)))
+    nrows = int(np.ceil(n / float(ncols)))
+    colors = color_grad(n)
+    for i, (key, x, y) in enumerate(groups):
+        plt.subplot(nrows, ncols, i + 1)
+        order = np.argsort(x)
+        plt.plot(x[order], y[order], '.', color=colors[i])
+        opt = coefficients(table, key)
+        if not np.isnan(opt).any():
+            plt.plot(x[order], model(x[order], *opt), '-', color=colors[i])
+            plt.title('%s: %s' % (key, ', '.join('%g' % c for c in opt)))
+        else:
+            plt.title('%s: %s' % (key, table.loc[key, 'error']))
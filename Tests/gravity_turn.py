@@ -1,40 +1,41 @@
 import numpy as np
 
+from Integrator import Integrator, Model
 from Sandbox import Sandbox
 from common import dt, plt_show_maxed
 
 
-class GTurn(Sandbox):
+class GTurn(Sandbox, Model):
+    # state: x, y, vx, vy, mass
+    split = 2
+
     def __init__(self, twr, mass, mflow, thrust_angle=5):
         self.T = mass*self.G*twr
         self.M = mass
         self.mflow = mflow
         self.a = np.deg2rad(thrust_angle)
 
-    def simulate(self, start_vel, start_angle, end_angle):
+    def derivative(self, t, s):
+        vx = s[..., 2]
+        vy = s[..., 3]
+        accel = self.T / s[..., 4]
+        thrust_angle = np.arctan2(vy, vx) - self.a
+        d = np.empty_like(s)
+        d[..., 0] = vx
+        d[..., 1] = vy
+        d[..., 2] = accel * np.cos(thrust_angle)
+        d[..., 3] = accel * np.sin(thrust_angle) - self.G
+        d[..., 4] = -self.mflow
+        return d
+
+    def simulate(self, start_vel, start_angle, end_angle, method='semi_implicit', substeps=1):
         start_angle = np.deg2rad(start_angle)
         end_angle = np.deg2rad(end_angle)
-        x = [0]
-        y = [0]
-        vx = [start_vel * np.cos(start_angle)]
-        vy = [start_vel * np.sin(start_angle)]
-        a = [start_angle]
-        t = [0]
-        m = self.M
-        while a[-1] > end_angle:
-            accel = self.T / m
-            thrust_angle = a[-1] - self.a
-            ax = accel * np.cos(thrust_angle)
-            ay = accel * np.sin(thrust_angle) - self.G
-            m -= self.mflow * dt
-            vx.append(vx[-1] + ax * dt)
-            vy.append(vy[-1] + ay * dt)
-            x.append(x[-1] + vx[-1] * dt)
-            y.append(y[-1] + vy[-1] * dt)
-            a.append(np.arctan2(vy[-1], vx[-1]))
-            t.append(t[-1] + dt)
-            print(t[-1], vx[-1], vy[-1], np.sqrt(vx[-1] * vx[-1] + vy[-1] * vy[-1]))
-        return t, a, x, y, vx, vy
+        s0 = [0, 0, start_vel * np.cos(start_angle), start_vel * np.sin(start_angle), self.M]
+        t, s = Integrator(self, method, dt, substeps).run(
+            s0, stop=lambda _t, _s: np.arctan2(_s[..., 3], _s[..., 2]) <= end_angle)
+        a = np.arctan2(s[:, 3], s[:, 2])
+        return t, a, s[:, 0], s[:, 1], s[:, 2], s[:, 3]
 
 
 if __name__ == '__main__':
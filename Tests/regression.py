@@ -0,0 +1,107 @@
+"""
+Headless regression benchmarks of the sandboxes against stored baselines.
+
+A benchmark is a list of cases, each a dict of the scenario parameters with
+a unique 'case' name, and a function simulate(**params) that runs the scenario
+with the parameters of a case (all but the name) and returns a dict of
+the measured quantities, e.g. ZeroStats and Metrics.
+run_cases() runs every case, adds its wall time as 'runtime' and returns
+a table with one row per case. The table is stored as a CSV baseline;
+compare() checks a new table against it, column by column, with an absolute
+and a relative tolerance for each column:
+    |new - base| <= abs + rel*|base|
+NaN (a metric that was not reached) only matches NaN. Only the columns given
+tolerances are checked, so runtime may be checked loosely or not at all.
+"""
+
+from __future__ import print_function
+import os
+from time import time as wall_time
+
+import numpy as np
+
+
+def run_cases(cases, simulate, repeat=1):
+    """
+    Runs simulate(**params) for every case.
+    :param repeat: number of runs of each case; the runtime is the best of them
+    :return: pandas DataFrame indexed by case name: the case parameters,
+             the measured quantities and the runtime in seconds
+    """
+    import pandas as pd
+    rows = []
+    for case in cases:
+        params = dict((k, v) for k, v in case.items() if k != 'case')
+        best = None
+        for _i in range(repeat):
+            start = wall_time()
+            measured = simulate(**params)
+            runtime = wall_time() - start
+            best = runtime if best is None else min(best, runtime)
+        row = dict(case)
+        row.update(measured)
+        row['runtime'] = best
+        rows.append(row)
+    table = pd.DataFrame(rows).set_index('case')
+    columns = [c for c in cases[0] if c != 'case'] if cases else []
+    return table[columns + sorted(c for c in table.columns if c not in columns)]
+
+
+def save_baseline(table, path):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    table.to_csv(path)
+
+
+def load_baseline(path):
+    import pandas as pd
+    return pd.read_csv(path, index_col='case')
+
+
+def compare(table, baseline, tolerances):
+    """
+    :param tolerances: {column: (abs, rel)}
+    :return: pandas DataFrame of the violations: case, column, baseline and new values;
+             cases missing from either table are reported with the column 'case'
+    """
+    import pandas as pd
+    flagged = []
+    for case in baseline.index.difference(table.index):
+        flagged.append((case, 'case', 'present', 'missing'))
+    for case in table.index.difference(baseline.index):
+        flagged.append((case, 'case', 'missing', 'present'))
+    common = table.index.intersection(baseline.index)
+    for column, (abs_tol, rel_tol) in sorted(tolerances.items()):
+        if column not in table.columns or column not in baseline.columns:
+            continue
+        new = table.loc[common, column].values.astype(float)
+        base = baseline.loc[common, column].values.astype(float)
+        nan = np.isnan(new) | np.isnan(base)
+        with np.errstate(invalid='ignore'):
+            bad = np.where(nan, np.isnan(new) != np.isnan(base),
+                           np.abs(new - base) > abs_tol + rel_tol * np.abs(base))
+        for case, b, n in zip(common[bad], base[bad], new[bad]):
+            flagged.append((case, column, b, n))
+    return pd.DataFrame(flagged, columns=('case', 'column', 'baseline', 'new'))
+
+
+def regression(cases, simulate, path, tolerances, update=False, repeat=1):
+    """
+    Runs the cases and compares them with the baseline at path.
+    If there is no baseline yet, or update is True, the results become the baseline.
+    :return: True if nothing changed beyond the tolerances
+    """
+    table = run_cases(cases, simulate, repeat)
+    print('%d cases, %.2f s of simulation' % (len(table), table['runtime'].sum()))
+    if update or not os.path.exists(path):
+        save_baseline(table, path)
+        print('Baseline saved to %s' % path)
+        return True
+    changes = compare(table, load_baseline(path), tolerances)
+    if changes.empty:
+        print('No changes beyond the tolerances')
+        return True
+    print('%d changes beyond the tolerances:' % len(changes))
+    print(changes.to_string(index=False))
+    return False
@@ -0,0 +1,334 @@
+"""
+Headless batch runs of sandbox scenarios.
+
+A spec is a dict of scenario parameters, given on the command line or in
+a JSON (or, with PyYAML, YAML) file holding a spec or a list of specs.
+List values are expanded into the product of cases, e.g.
+    {"engine": "wheesly", "AA": [0.3, 1, 3], "angle": [85, 25, 3], "seed": [0, 1]}
+is 18 cases. A sandbox provides simulate(**case) returning the usual
+(name, time, error, action, ..., zero_stats) tuple; run_scenarios() runs the
+cases, in a pool if asked, reusing the results found in a ResultStore;
+the pool workers send the traces back through a SharedTraces block.
+stream_scenarios() passes every result to a sink as soon as it is done
+instead of keeping them: a callback, a SummarySink or a TraceSink.
+The results are written as two tables:
+    <out>-summary   one row per case: its parameters, ZeroStats and the Metrics
+                    computed from the recorded error and action
+    <out>-traces    the recorded columns of every case, with the case number
+in Parquet or Feather (both need pyarrow) or CSV format.
+"""
+
+from __future__ import print_function
+import argparse
+import itertools
+import json
+import os
+import traceback
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from time import time as wall_time
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import numpy as np
+
+from Metrics import Metrics
+from SharedTraces import SharedTraces, attach, pack
+
+formats = ('parquet', 'feather', 'csv')
+
+
+def load_specs(path):
+    """:return: the list of specs in a JSON or YAML file"""
+    with open(path) as f:
+        if path.endswith('.yaml') or path.endswith('.yml'):
+            import yaml
+            specs = yaml.safe_load(f)
+        else:
+            specs = json.load(f)
+    return specs if isinstance(specs, list) else [specs]
+
+
+def expand(specs):
+    """:return: the cases of the specs: the products of their list values, in order"""
+    cases = []
+    for spec in specs:
+        names = sorted(spec)
+        values = [spec[n] if isinstance(spec[n], list) else [spec[n]] for n in names]
+        for combination in itertools.product(*values):
+            cases.append(dict(zip(names, combination)))
+    return cases
+
+
+def _simulate(work):
+    simulate, case, slot = work
+    start = wall_time()
+    try:
+        result = simulate(**case)
+    except Exception:
+        # a pool does not call back on errors in python2
+        return None, None, traceback.format_exc()
+    runtime = wall_time() - start
+    return pack(slot, result), runtime, None
+
+
+def _done(queue, n, slot, outcome):
+    queue.put((n, slot, outcome))
+
+
+def stream_scenarios(cases, simulate, sink, workers=1, traces=(4, 0), slots=None):
+    """
+    Runs simulate(**case) for every case and calls sink(n, case, result, runtime)
+    with each result as soon as it is done, so the results need not be kept.
+    :param workers: number of processes; None means cpu_count(), 1 runs in this process
+    :param traces: (arrays, samples) of a SharedTraces slot, as in run_scenarios;
+                   a slot is reused once the sink returns, so a sink keeping the traces should copy them
+    :param slots: the most cases in flight at once, each with its slot; 2*workers by default
+    """
+    workers = min(workers or cpu_count(), len(cases))
+    if workers <= 1:
+        for n, case in enumerate(cases):
+            start = wall_time()
+            result = simulate(**case)
+            sink(n, case, result, wall_time() - start)
+        return
+    slots = slots or 2 * workers
+    shared = SharedTraces(slots, *traces) if traces[1] else None
+    queue = Queue()
+    free = list(range(slots))
+    todo = list(range(len(cases)))[::-1]
+    running = 0
+    finished = False
+    pool = Pool(workers, attach, (shared,))
+    try:
+        while todo or running:
+            while todo and free:
+                n = todo.pop()
+                slot = free.pop()
+                pool.apply_async(_simulate, ((simulate, cases[n], slot),), callback=partial(_done, queue, n, slot))
+                running += 1
+            n, slot, (result, runtime, error) = queue.get()
+            running -= 1
+            if error is not None:
+                raise RuntimeError('Case %d %s failed:\n%s' % (n, cases[n], error))
+            if shared is not None:
+                result = shared.unpack(slot, result)
+            sink(n, cases[n], result, runtime)
+            free.append(slot)
+        finished = True
+    finally:
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+
+def run_scenarios(cases, simulate, workers=1, store=None, key=None, traces=(4, 0)):
+    """
+    Runs simulate(**case) for every case.
+    :param workers: number of processes; None means cpu_count(), 1 runs in this process
+    :param store: a ResultStore; the cases found in it are not simulated again
+    :param key: key(case) of a case in the store
+    :param traces: (arrays, samples) of the SharedTraces slot of a case: the pool workers
+                   put up to that many arrays of a result, of up to samples values each,
+                   in shared memory, and the results hold views of it; 0 samples pickles them
+    :return: [(result, runtime)] in the order of the cases; runtime is None for the stored ones
+    """
+    results = [None] * len(cases)
+    keys = [None] * len(cases)
+    if store is not None:
+        for n, case in enumerate(cases):
+            keys[n] = key(case)
+            result = store.get(keys[n])
+            if result is not None:
+                results[n] = (result, None)
+    todo = [n for n, r in enumerate(results) if r is None]
+
+    def collect(n, _case, result, runtime):
+        results[todo[n]] = (result, runtime)
+    # a slot per case, so that every result keeps its traces
+    stream_scenarios([cases[n] for n in todo], simulate, collect, workers, traces, len(todo))
+    if store is not None:
+        for n in todo:
+            store.put(keys[n], results[n][0], 'scenario', False, **cases[n])
+        store.commit()
+    return results
+
+
+def result_metrics(result, **kwargs):
+    """Metrics of a recorded run: from the time, error and action columns of the result"""
+    time, error, action = result[1], result[2], result[3]
+    metrics = Metrics(error[0], **kwargs)
+    for t, e, a in zip(time[1:], error[1:], action[1:]):
+        metrics.update(t, e, a)
+    return metrics
+
+
+def _cell(value):
+    # a case parameter in a table: scalars as they are, the rest as JSON or by name
+    if np.isscalar(value):
+        return value
+    try:
+        return json.dumps(value)
+    except TypeError:
+        return getattr(value, 'name', None) or getattr(value, '__name__', None) or type(value).__name__
+
+
+def summary_row(case, result, runtime, **kwargs):
+    """:return: dict of the case parameters, the ZeroStats, the Metrics and the runtime of a result"""
+    zero_stats = result[-1]
+    row = dict((k, _cell(v)) for k, v in case.items())
+    row['name'] = result[0]
+    row['zero_time'] = zero_stats.time if zero_stats else np.nan
+    row['zero_speed'] = zero_stats.speed if zero_stats else np.nan
+    row.update(zip(Metrics.columns, result_metrics(result, **kwargs).row()))
+    row['runtime'] = np.nan if runtime is None else runtime
+    return row
+
+
+def summary_table(cases, results, **kwargs):
+    """:return: pandas DataFrame with a row per case: its parameters, ZeroStats, Metrics and runtime"""
+    import pandas as pd
+    table = pd.DataFrame([summary_row(case, result, runtime, **kwargs)
+                          for case, (result, runtime) in zip(cases, results)])
+    table.index.name = 'case'
+    return table
+
+
+def _arrays(value):
+    # the arrays of a result in order, including those of the addons
+    if isinstance(value, np.ndarray):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            for a in _arrays(v):
+                yield a
+
+
+def trace_frame(n, result, columns):
+    """
+    :param columns: names of the arrays of a result, in order, e.g. ('time', 'error', 'action', 'thrust')
+    :return: pandas DataFrame of the traces of a result, with the case number n in the 'case' column
+    """
+    import pandas as pd
+    frame = pd.DataFrame(dict(zip(columns, _arrays(result))), columns=columns)
+    frame.insert(0, 'case', n)
+    return frame
+
+
+def trace_table(results, columns):
+    """:return: pandas DataFrame of all the traces, see trace_frame"""
+    import pandas as pd
+    return pd.concat([trace_frame(n, result, columns) for n, (result, _runtime) in enumerate(results)],
+                     ignore_index=True)
+
+
+class SummarySink(object):
+    """
+    Sink of stream_scenarios that reduces each result to its summary_row
+    and drops the traces; table() is then the summary_table of the cases.
+    :param kwargs: the Metrics arguments, e.g. min_band
+    """
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.rows = {}
+
+    def __call__(self, n, case, result, runtime):
+        self.rows[n] = summary_row(case, result, runtime, **self.kwargs)
+
+    def table(self):
+        import pandas as pd
+        cases = sorted(self.rows)
+        table = pd.DataFrame([self.rows[n] for n in cases], index=cases)
+        table.index.name = 'case'
+        return table
+
+
+class TraceSink(object):
+    """
+    Sink of stream_scenarios that appends the traces of each result,
+    as a trace_frame, to path.<fmt> as soon as it is done; close() finishes the file.
+    Parquet is written by row groups, CSV by lines; Feather cannot be written by parts.
+    """
+    def __init__(self, path, columns, fmt='parquet'):
+        if fmt not in ('parquet', 'csv'):
+            raise ValueError('Cannot stream to %s' % fmt)
+        self.filename = '%s.%s' % (path, fmt)
+        self.columns = columns
+        self.fmt = fmt
+        self._out = None
+
+    def __call__(self, n, case, result, runtime):
+        frame = trace_frame(n, result, self.columns)
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._out is None:
+                self._out = pq.ParquetWriter(self.filename, table.schema)
+            self._out.write_table(table)
+        else:
+            header = self._out is None
+            if header:
+                self._out = open(self.filename, 'w')
+            frame.to_csv(self._out, header=header, index=False)
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+
+
+def write_table(table, path, fmt):
+    """Writes the table to path.<fmt>; :return: the file name"""
+    filename = '%s.%s' % (path, fmt)
+    if fmt == 'parquet':
+        table.to_parquet(filename)
+    elif fmt == 'feather':
+        table.reset_index(drop=table.index.name is None).to_feather(filename)
+    elif fmt == 'csv':
+        table.to_csv(filename)
+    else:
+        raise ValueError('Unknown format: %s' % fmt)
+    return filename
+
+
+def arg_parser(description):
+    """The common arguments of the scenario runners; a sandbox adds its scenario parameters"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('specs', nargs='*', help='JSON or YAML files of scenario specs')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes, 0 for one per CPU')
+    parser.add_argument('--out', default='scenarios', help='prefix of the output files')
+    parser.add_argument('--format', choices=formats, default='parquet')
+    parser.add_argument('--no-traces', action='store_true', help='write the summary only')
+    return parser
+
+
+def specs_from_args(args, params):
+    """
+    :param params: names of the scenario parameters among the args
+    :return: the specs of the files, if any, each updated with the parameters given on the command line;
+             otherwise a single spec of the parameters
+    """
+    given = dict((p, getattr(args, p)) for p in params if getattr(args, p) is not None)
+    specs = [s for path in args.specs for s in load_specs(path)] or [{}]
+    for spec in specs:
+        spec.update(given)
+    return specs
+
+
+def write_results(args, cases, results, columns, **kwargs):
+    """Writes the summary and, unless --no-traces, the traces as the args tell"""
+    out = os.path.dirname(args.out)
+    if out and not os.path.isdir(out):
+        os.makedirs(out)
+    files = [write_table(summary_table(cases, results, **kwargs), args.out + '-summary', args.format)]
+    if not args.no_traces:
+        files.append(write_table(trace_table(results, columns), args.out + '-traces', args.format))
+    for f in files:
+        print('Written %s' % f)
+    return files
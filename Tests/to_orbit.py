@@ -4,10 +4,15 @@ import numpy as np
 import pandas as pd
 import math
 
-class Vessel(object):
+from Integrator import Integrator, Model
+
+class Vessel(Model):
     R  = 600000
     G  = 9.81
     cG = G*R*R
+    decimate = 1
+    # state: h, v
+    split = 1
 
     @classmethod
     def StG(cls, h):
@@ -84,39 +89,42 @@ class Vessel(object):
             if atm: v -= (atm(H) * (v**2) * self.Cd * self.S) / 2 / m * dt
         return H
 
-    def simulate(self, ApA, dt=0.01, atm=None):
-        t = [0.0]
-        v = [0.0]
-        h = [0.0]
-        Tf = [1.0]
-        m = self.M
-        thrust = True
-        hmove = ApA
-        while v[-1] >= 0:
-            if thrust:
-                dm = self.mflow*dt
-                if m <= dm:
-                    thrust = False
-                    continue
-                m -= dm
-                apa = self.freefall(m, h[-1], v[-1], atm, dt * 4)
-                dapa = ApA-apa
-                vv = dapa/max(v[-1],1)
-                hv = hmove/max(dapa, 60)*60*math.sqrt(min(max(h[-1]/70000, 0), 1))*min((apa-h[-1])/100, 1)
-                hmove -= hv*dt
-                Tf.append(math.sin(math.atan2(vv, hv)))
-                T = self.T*Tf[-1]
-                v1 = v[-1]+(T/m-self.StG(h[-1]))*dt
-                thrust = ApA-apa > 1
+    def control(self, t, y):
+        h, v = y
+        self.Tf = 0
+        if self.thrust:
+            dm = self.mflow*self.dt
+            if self.m <= dm:
+                self.thrust = False
             else:
-                v1 = v[-1] - self.StG(h[-1]) * dt
-                Tf.append(0)
-            if atm:
-                v1 -= (atm(h[-1]) * (v[-1] ** 2) * self.Cd * self.S) / 2 / m * dt
-            v.append(v1)
-            h.append(h[-1]+v1*dt)
-            t.append(t[-1]+dt)
-        return t, h, v, Tf
+                self.m -= dm
+                apa = self.freefall(self.m, h, v, self.atm, self.dt * 4)
+                dapa = self.ApA-apa
+                vv = dapa/max(v,1)
+                hv = self.hmove/max(dapa, 60)*60*math.sqrt(min(max(h/70000, 0), 1))*min((apa-h)/100, 1)
+                self.hmove -= hv*self.dt
+                self.Tf = math.sin(math.atan2(vv, hv))
+                self.thrust = self.ApA-apa > 1
+        self.Tfs.append(self.Tf)
+
+    def derivative(self, t, y):
+        h, v = y
+        a = self.T*self.Tf/self.m-self.StG(h)
+        if self.atm:
+            a -= (self.atm(h) * (v ** 2) * self.Cd * self.S) / 2 / self.m
+        return np.array([v, a])
+
+    def simulate(self, ApA, dt=0.01, atm=None, method='semi_implicit', substeps=1):
+        self.ApA = ApA
+        self.dt = dt
+        self.atm = atm
+        self.m = self.M
+        self.thrust = True
+        self.hmove = ApA
+        self.Tfs = [1.0]
+        t, y = Integrator(self, method, dt, substeps).run([0.0, 0.0], stop=lambda _t, _y: _y[1] < 0)
+        d = self.decimate
+        return t[::d], y[::d, 0], y[::d, 1], np.array(self.Tfs)[::d]
 
 if __name__ == '__main__':
     # TCA Test 6.RendezvouAutopilot: T 928.8749*0.919181502342862, M 67.045, mflow 0.2814892